@@ -2,7 +2,7 @@
 """Simple benchmark to demonstrate performance improvements."""
 
 import time
-from scopedstats import Recorder, incr, timer
+from scopedstats import Recorder, counter, incr, tagset, timer
 
 
 def benchmark_basic_operations():
@@ -23,17 +23,345 @@ def benchmark_basic_operations():
             incr("with_tags", tags={"type": "benchmark", "batch": i // 1000})
     with_tags_time = time.perf_counter() - start
 
+    # Test with pre-built tag sets (normalization skipped)
+    handles = [tagset({"type": "benchmark", "batch": b}) for b in range(10)]
+    start = time.perf_counter()
+    with recorder.record():
+        for i in range(10000):
+            incr("with_tagset", tags=handles[i // 1000])
+    with_tagset_time = time.perf_counter() - start
+
+    # Test with pre-registered counter handles (slot cached per collector)
+    rows = counter("with_handle", tags={"type": "benchmark"})
+    start = time.perf_counter()
+    with recorder.record():
+        for i in range(10000):
+            rows.incr()
+    with_handle_time = time.perf_counter() - start
+
     print("✨ Performance Benchmark Results:")
     print(f"   No tags:   {no_tags_time:.4f}s ({10000 / no_tags_time:.0f} ops/sec)")
     print(f"   With tags: {with_tags_time:.4f}s ({10000 / with_tags_time:.0f} ops/sec)")
+    print(
+        f"   With tagset: {with_tagset_time:.4f}s ({10000 / with_tagset_time:.0f} ops/sec)"
+    )
+    print(
+        f"   Counter handle: {with_handle_time:.4f}s ({10000 / with_handle_time:.0f} ops/sec)"
+    )
     print(f"   Tag overhead: {((with_tags_time / no_tags_time - 1) * 100):.1f}%")
+    print(
+        f"   Tagset overhead: {((with_tagset_time / no_tags_time - 1) * 100):.1f}%"
+    )
 
     results = recorder.get_result()
     print(
-        f"   Final counts: no_tags={results['no_tags']}, with_tags={results['with_tags']}"
+        f"   Final counts: no_tags={results['no_tags']}, with_tags={results['with_tags']}, "
+        f"with_tagset={results['with_tagset']}, with_handle={results['with_handle']}"
     )
 
 
+def benchmark_filtered_queries():
+    """Compare tag-filtered get_result against a full scan of every series."""
+    from scopedstats import _get_filtered_stats
+
+    recorder = Recorder()
+    with recorder.record():
+        for i in range(20000):
+            incr("requests", tags={"tenant": str(i % 2000), "shard": str(i % 10)})
+
+    tag_filter = {"tenant": "42"}
+    runs = 200
+    recorder.get_result()
+
+    start = time.perf_counter()
+    for _ in range(runs):
+        _get_filtered_stats(recorder._store._items(), tag_filter)
+    scan_time = (time.perf_counter() - start) / runs
+
+    start = time.perf_counter()
+    for _ in range(runs):
+        recorder.get_result(tag_filter=tag_filter)
+    indexed_time = (time.perf_counter() - start) / runs
+
+    print("🔎 Filtered get_result (2000 tag combinations):")
+    print(f"   Full scan: {scan_time * 1e6:.1f}µs per query")
+    print(f"   Indexed:   {indexed_time * 1e6:.1f}µs per query")
+
+
+def benchmark_group_by():
+    """Compare one group_by query against one filtered query per endpoint."""
+    recorder = Recorder()
+    endpoints = [f"/endpoint/{i}" for i in range(50)]
+    with recorder.record():
+        for i in range(20000):
+            incr(
+                "requests",
+                tags={"endpoint": endpoints[i % 50], "method": ("GET", "POST")[i % 2]},
+            )
+
+    runs = 20
+
+    start = time.perf_counter()
+    for _ in range(runs):
+        for endpoint in endpoints:
+            recorder.get_result(tag_filter={"endpoint": endpoint})
+    per_endpoint_time = (time.perf_counter() - start) / runs
+
+    start = time.perf_counter()
+    for _ in range(runs):
+        recorder.get_result(group_by=["endpoint", "method"])
+    group_by_time = (time.perf_counter() - start) / runs
+
+    print("📊 Per-endpoint breakdown (50 endpoints):")
+    print(f"   One filtered query per endpoint: {per_endpoint_time * 1e6:.1f}µs")
+    print(f"   Single group_by query:           {group_by_time * 1e6:.1f}µs")
+
+
+def benchmark_storage_engines():
+    """Compare ns/op and allocations of the storage engines."""
+    import gc
+    import sys
+
+    shapes = {
+        "200 keys x 20 tag sets": (
+            [f"metric.{i}" for i in range(200)],
+            [tagset({"shard": str(i)}) for i in range(20)],
+        ),
+        "4000 untagged keys": ([f"metric.{i}" for i in range(4000)], [tagset()]),
+    }
+    ops = 100000
+
+    print("🗄️  Storage engines:")
+    for shape, (keys, tag_sets) in shapes.items():
+        print(f"   {shape}:")
+        for storage in ("nested", "flat", "array"):
+            recorder = Recorder(storage=storage)
+            n_keys, n_tags = len(keys), len(tag_sets)
+
+            start = time.perf_counter()
+            with recorder.record():
+                for i in range(ops):
+                    incr(keys[i % n_keys], tags=tag_sets[i // n_keys % n_tags])
+            incr_ns = (time.perf_counter() - start) / ops * 1e9
+
+            # Allocations retained by one collector holding every series
+            gc.collect()
+            gc.disable()
+            collector = recorder._store.__class__()
+            blocks_before = sys.getallocatedblocks()
+            for key in keys:
+                for tags in tag_sets:
+                    collector._add(key, tags, 1)
+            blocks = sys.getallocatedblocks() - blocks_before
+            gc.enable()
+
+            start = time.perf_counter()
+            for _ in range(20):
+                recorder._merge_collector(collector)
+            merge_us = (time.perf_counter() - start) / 20 * 1e6
+
+            handle = counter(keys[-1], tags=tag_sets[-1])
+            start = time.perf_counter()
+            with recorder.record():
+                for i in range(ops):
+                    handle.incr()
+            handle_ns = (time.perf_counter() - start) / ops * 1e9
+
+            print(
+                f"     {storage:<7} incr: {incr_ns:4.0f}ns/op   "
+                f"handle: {handle_ns:4.0f}ns/op   "
+                f"allocated blocks: {blocks:5d}   merge: {merge_us:6.1f}µs"
+            )
+
+
+def benchmark_scope_overhead():
+    """Measure record() enter/exit cost for empty and small scopes."""
+    recorder = Recorder()
+    scopes = 20000
+
+    start = time.perf_counter()
+    for _ in range(scopes):
+        with recorder.record():
+            pass
+    empty_ns = (time.perf_counter() - start) / scopes * 1e9
+
+    start = time.perf_counter()
+    for _ in range(scopes):
+        with recorder.record():
+            incr("db.queries")
+            incr("cache.hits", amount=2)
+            incr("cache.misses")
+    small_ns = (time.perf_counter() - start) / scopes * 1e9
+
+    print("🚪 record() enter/exit cost:")
+    print(f"   Empty scope:          {empty_ns:6.0f}ns")
+    print(f"   Scope with 3 incr():  {small_ns:6.0f}ns")
+
+
+def benchmark_tail_retention():
+    """Compare always-merged scopes with scopes discarded by min_duration."""
+    scopes = 20000
+    keys = [f"db.query.{i}" for i in range(10)]
+
+    print("🪣 Tail retention (10 keys per scope, results read at the end):")
+    for label, options in (
+        ("Always merged", {}),
+        ("Discarded", {"min_duration": 1.0}),
+    ):
+        recorder = Recorder()
+        start = time.perf_counter()
+        for _ in range(scopes):
+            with recorder.record(**options):
+                for key in keys:
+                    incr(key)
+        recorder.get_result()
+        scope_ns = (time.perf_counter() - start) / scopes * 1e9
+        print(f"   {label + ':':<15} {scope_ns:6.0f}ns per scope")
+
+
+def benchmark_collector_pool():
+    """Compare scope cost and GC churn with and without collector pooling."""
+    import gc
+
+    from scopedstats import _DEFAULT_COLLECTOR_POOL_SIZE, set_collector_pool_size
+
+    scopes = 20000
+    keys = [f"db.query.{i}" for i in range(10)]
+
+    print("♻️  Collector pool (10 keys per scope, results read every 64 scopes):")
+    for label, pool_size in (("Pooled", _DEFAULT_COLLECTOR_POOL_SIZE), ("No pool", 0)):
+        set_collector_pool_size(pool_size)
+        recorder = Recorder()
+        gc.collect()
+        collections_before = gc.get_stats()[0]["collections"]
+        start = time.perf_counter()
+        for i in range(scopes):
+            with recorder.record():
+                for key in keys:
+                    incr(key)
+            if i % 64 == 63:
+                recorder.get_result()
+        scope_ns = (time.perf_counter() - start) / scopes * 1e9
+        collections = gc.get_stats()[0]["collections"] - collections_before
+        print(
+            f"   {label + ':':<9} {scope_ns:6.0f}ns per scope, "
+            f"{collections} young-generation GC runs"
+        )
+    set_collector_pool_size(_DEFAULT_COLLECTOR_POOL_SIZE)
+
+
+def benchmark_disabled():
+    """Compare disabled instrumentation with uninstrumented code."""
+    from scopedstats import disable, enable
+
+    calls = 200000
+
+    def plain():
+        return None
+
+    timed_plain = timer(key="plain")(plain)
+
+    def loop(func):
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        return (time.perf_counter() - start) / calls * 1e9
+
+    def incr_loop():
+        start = time.perf_counter()
+        for _ in range(calls):
+            incr("requests")
+        return (time.perf_counter() - start) / calls * 1e9
+
+    def empty_loop():
+        start = time.perf_counter()
+        for _ in range(calls):
+            pass
+        return (time.perf_counter() - start) / calls * 1e9
+
+    idle_timer, idle_incr = loop(timed_plain), incr_loop()
+    disable()
+    try:
+        disabled_timer, disabled_incr = loop(timed_plain), incr_loop()
+    finally:
+        enable()
+
+    print("🔌 disable() (no active recorder):")
+    print(f"   Plain function call:   {loop(plain):5.0f}ns")
+    print(f"   @timer, enabled:       {idle_timer:5.0f}ns")
+    print(f"   @timer, disabled:      {disabled_timer:5.0f}ns")
+    print(f"   Empty loop iteration:  {empty_loop():5.0f}ns")
+    print(f"   incr(), enabled:       {idle_incr:5.0f}ns")
+    print(f"   incr(), disabled:      {disabled_incr:5.0f}ns")
+
+
+def benchmark_incr_many():
+    """Compare 20 incr() calls with one incr_many() call per unit of work."""
+    from scopedstats import incr_many
+
+    units = 20000
+    updates = {f"work.step{i}": i for i in range(20)}
+    tags = tagset({"endpoint": "/users"})
+
+    recorder = Recorder()
+    start = time.perf_counter()
+    with recorder.record():
+        for _ in range(units):
+            for key, amount in updates.items():
+                incr(key, tags=tags, amount=amount)
+    incr_ns = (time.perf_counter() - start) / units * 1e9
+
+    start = time.perf_counter()
+    with recorder.record():
+        for _ in range(units):
+            incr_many(updates, tags=tags)
+    many_ns = (time.perf_counter() - start) / units * 1e9
+
+    print("📦 Batch increments (20 keys per unit of work):")
+    print(f"   20 x incr():   {incr_ns:6.0f}ns")
+    print(f"   incr_many():   {many_ns:6.0f}ns")
+
+
+def benchmark_nesting_depth():
+    """Measure nested record() cost as the recorder stack gets deeper.
+
+    Every recorder is read, and each one reads the distinct series recorded
+    under its scope; "per series read" divides by that total. With per-level
+    keys that total grows with depth, with shared keys it does not.
+    """
+    keys_per_level = 50
+    runs = 200
+
+    def nested(recorders, level, prefix):
+        with recorders[level].record():
+            for i in range(keys_per_level):
+                incr(f"{prefix(level)}key{i}")
+            if level + 1 < len(recorders):
+                nested(recorders, level + 1, prefix)
+
+    cases = (
+        ("different keys per level", lambda level: f"level{level}."),
+        ("same keys at every level", lambda level: ""),
+    )
+    for name, prefix in cases:
+        print(f"🪆 Nested recorders ({keys_per_level} keys per level, {name}):")
+        for depth in (1, 2, 4, 8, 16):
+            start = time.perf_counter()
+            for _ in range(runs):
+                recorders = [Recorder() for _ in range(depth)]
+                nested(recorders, 0, prefix)
+                for recorder in recorders:
+                    recorder.get_result()
+            elapsed = (time.perf_counter() - start) / runs
+            events = depth * keys_per_level
+            reads = sum(len(recorder.get_result()) - 1 for recorder in recorders)
+            print(
+                f"   depth {depth:2d}: {elapsed * 1e6:8.1f}µs per request, "
+                f"{elapsed / events * 1e9:5.0f}ns per recorded event, "
+                f"{elapsed / reads * 1e9:4.0f}ns per series read"
+            )
+
+
 def benchmark_memory_usage():
     """Show memory efficiency with __slots__."""
     import sys
@@ -77,6 +405,24 @@ if __name__ == "__main__":
 
     benchmark_basic_operations()
     print()
+    benchmark_filtered_queries()
+    print()
+    benchmark_group_by()
+    print()
+    benchmark_storage_engines()
+    print()
+    benchmark_scope_overhead()
+    print()
+    benchmark_tail_retention()
+    print()
+    benchmark_collector_pool()
+    print()
+    benchmark_disabled()
+    print()
+    benchmark_incr_many()
+    print()
+    benchmark_nesting_depth()
+    print()
     benchmark_memory_usage()
     print()
     demo_timing()
@@ -1,174 +1,2356 @@
 from __future__ import annotations
 
 from contextvars import ContextVar
-from typing import Callable, TypeVar, ParamSpec, Generator
-from contextlib import contextmanager
-from collections import defaultdict
+from typing import (
+    Callable,
+    AsyncGenerator,
+    Coroutine,
+    Generator,
+    TypeVar,
+    ParamSpec,
+    Any,
+    Iterable,
+    Iterator,
+    Mapping,
+    NamedTuple,
+    Sequence,
+    overload,
+)
+from collections import OrderedDict, defaultdict, deque
 import time
 import functools
+import inspect
+import json
+import math
+import os
+import random
+import sys
+import threading
+import types
+import zlib
+from types import TracebackType
+
+T = TypeVar("T")
+P = ParamSpec("P")
+Tags = dict[str, str | bool]
+_TagsTuple = tuple[tuple[str, str | bool], ...]
+# A series is one (key, tags) combination
+_Series = tuple[str, _TagsTuple]
+# Container returned by _Collector._slot: a dict or list supporting x[sub] += n
+_SlotStorage = Any
+
+
+class TagSet(_TagsTuple):
+    """Immutable, hashable, already-normalized tags. Create with tagset().
+
+    Passing a TagSet as ``tags`` skips tag normalization entirely, which makes
+    it the cheapest way to tag metrics with a set of tags known up front.
+    """
+
+    __slots__ = ()
+
+    def __repr__(self) -> str:
+        return f"tagset({dict(self)!r})"
+
 
+_DEFAULT_TAG_CACHE_SIZE = 4096
 
-# Cache for tag tuples to avoid repeated sorting
-_tag_cache: dict[
-    frozenset[tuple[str, str | bool]], tuple[tuple[str, str | bool], ...]
-] = {}
 
+class TagCacheInfo(NamedTuple):
+    """Snapshot of the tag normalization cache counters."""
 
-_current_collector: ContextVar[_StatsCollector | None] = ContextVar(
+    hits: int
+    misses: int
+    evictions: int
+    maxsize: int
+    currsize: int
+
+
+class _TagCache:
+    """Bounded cache mapping tag sets to their normalized sorted tuples.
+
+    Entries live in two generations. Lookups check the young generation first,
+    so a working set that fits in the cache costs a single dict lookup per hit.
+    Entries only found in the old generation are promoted back to the young
+    one. The cache fills up to maxsize; after that each new entry evicts the
+    oldest entry of the old generation, and when the old generation runs out
+    the young one takes its place. This approximates LRU without touching
+    recency state on every hit.
+    """
+
+    __slots__ = (
+        "_young",
+        "_old",
+        "maxsize",
+        "hits",
+        "misses",
+        "evictions",
+    )
+
+    def __init__(self, maxsize: int = _DEFAULT_TAG_CACHE_SIZE) -> None:
+        self._young: OrderedDict[
+            frozenset[tuple[str, str | bool]], _TagsTuple
+        ] = OrderedDict()
+        self._old: OrderedDict[
+            frozenset[tuple[str, str | bool]], _TagsTuple
+        ] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.maxsize = 0
+        self.resize(maxsize)
+
+    def lookup(
+        self, cache_key: frozenset[tuple[str, str | bool]], tags: Tags
+    ) -> _TagsTuple:
+        """Slow path for keys missing from the young generation."""
+        tags_tuple = self._old.pop(cache_key, None)
+        if tags_tuple is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            tags_tuple = tuple(sorted(tags.items()))
+            if self.maxsize == 0:
+                return tags_tuple
+            self._evict(self.maxsize - 1)
+        self._young[cache_key] = tags_tuple
+        return tags_tuple
+
+    def _evict(self, limit: int) -> None:
+        """Evict the oldest entries until at most limit are left."""
+        young = self._young
+        old = self._old
+        while len(young) + len(old) > limit:
+            if not old:
+                self._old = old = young
+                self._young = young = OrderedDict()
+            old.popitem(last=False)
+            self.evictions += 1
+
+    def resize(self, maxsize: int) -> None:
+        if maxsize < 0:
+            raise ValueError("maxsize must be >= 0")
+        self.maxsize = maxsize
+        self._evict(maxsize)
+
+    def clear(self) -> None:
+        self._young = OrderedDict()
+        self._old = OrderedDict()
+        self.hits = self.misses = self.evictions = 0
+
+    def info(self) -> TagCacheInfo:
+        return TagCacheInfo(
+            self.hits,
+            self.misses,
+            self.evictions,
+            self.maxsize,
+            len(self._young) + len(self._old),
+        )
+
+
+_current_collector: ContextVar[_Collector | None] = ContextVar(
     "current_collector", default=None
 )
 
-T = TypeVar("T")
-P = ParamSpec("P")
-Tags = dict[str, str | bool]
+_tag_cache = _TagCache()
+
+# Process-wide kill switch checked before any collector lookup; see disable()
+_enabled = True
+
+# (sampled, sample_rate) decided by the outermost sampled record() scope;
+# scopes nested inside it follow the same decision
+_sampling: ContextVar[tuple[bool, float] | None] = ContextVar(
+    "sampling", default=None
+)
+
+
+def disable() -> None:
+    """Turn all recording off process-wide.
+
+    Until enable() is called, record() scopes install no collector, and
+    incr(), the other recording functions, handles and timer-decorated
+    functions return straight away or just call the wrapped function,
+    without looking up the current collector.
+    """
+    global _enabled
+    _enabled = False
+
+
+def enable() -> None:
+    """Turn recording back on after disable()."""
+    global _enabled
+    _enabled = True
+
 
+def is_enabled() -> bool:
+    """Return False while recording is turned off by disable()."""
+    return _enabled
 
-def _normalize_tags(tags: Tags | None) -> tuple[tuple[str, str | bool], ...]:
+
+def _normalize_tags(
+    tags: Tags | TagSet | None,
+) -> _TagsTuple:
     """Normalize tags to a sorted tuple, with caching for performance."""
     if not tags:
         return ()
+    if tags.__class__ is TagSet:
+        return tags  # type: ignore[return-value]
 
     # Use frozenset as cache key for fast lookup
     cache_key = frozenset(tags.items())
-    if cache_key not in _tag_cache:
-        _tag_cache[cache_key] = tuple(sorted(tags.items()))
-    return _tag_cache[cache_key]
+    tags_tuple = _tag_cache._young.get(cache_key)
+    if tags_tuple is not None:
+        _tag_cache.hits += 1
+        return tags_tuple
+    return _tag_cache.lookup(cache_key, tags)  # type: ignore[arg-type]
+
+
+def tagset(tags: Tags | TagSet | None = None) -> TagSet:
+    """Normalize tags once into a reusable TagSet handle.
+
+    The handle can be passed anywhere ``tags`` is accepted (incr, timer, ...)
+    and skips per-call normalization.
+    """
+    if not tags:
+        return TagSet()
+    if tags.__class__ is TagSet:
+        return tags  # type: ignore[return-value]
+    return TagSet(sorted(tags.items()))  # type: ignore[union-attr]
+
+
+def set_tag_cache_size(maxsize: int) -> None:
+    """Bound the number of distinct tag sets kept in the normalization cache.
+
+    Tag sets that have not been used recently are evicted once the cache is
+    full. A size of 0 disables caching entirely.
+    """
+    _tag_cache.resize(maxsize)
+
+
+def tag_cache_info() -> TagCacheInfo:
+    """Return hit/miss/eviction counters and the current size of the tag cache."""
+    return _tag_cache.info()
+
+
+def clear_tag_cache() -> None:
+    """Drop all cached tag sets and reset the cache counters."""
+    _tag_cache.clear()
+
+
+# Metric kinds. Counters are the default and are left out of a collector's
+# _kinds, so counter-only collectors keep the plain-addition merge paths.
+_COUNTER = 0
+_GAUGE = 1
+_MAX = 2
+_MIN = 3
+# Kinds from here on hold mergeable objects rather than numbers; see
+# _Histogram for the methods they provide
+_HISTOGRAM = 4
+_SKETCH = 5
+_SUMMARY = 6
+
+_KIND_NAMES = {
+    _COUNTER: "counter",
+    _GAUGE: "gauge",
+    _MAX: "max",
+    _MIN: "min",
+    _HISTOGRAM: "histogram",
+    _SKETCH: "sketch",
+    _SUMMARY: "summary",
+}
+
+# Kinds get_quantile can answer
+_QUANTILE_KINDS = (_HISTOGRAM, _SKETCH)
+
+# Histogram buckets: each power of two between 2**(_HISTOGRAM_MIN_EXP - 1)
+# and 2**_HISTOGRAM_MAX_EXP is split into _HISTOGRAM_SUB_BUCKETS equal
+# buckets (about 0.5µs to 8192s for durations in seconds). Bucket 0 holds
+# anything smaller, the last bucket anything larger.
+_HISTOGRAM_SUB_BUCKETS = 16
+_HISTOGRAM_MIN_EXP = -20
+_HISTOGRAM_MAX_EXP = 13
+_HISTOGRAM_LOWEST = math.ldexp(0.5, _HISTOGRAM_MIN_EXP)
+_HISTOGRAM_BUCKETS = (
+    _HISTOGRAM_MAX_EXP - _HISTOGRAM_MIN_EXP + 1
+) * _HISTOGRAM_SUB_BUCKETS + 1
+# Bucket of mantissa * 2**exponent is
+# int(mantissa * 2 * SUB) + exponent * SUB + _HISTOGRAM_INDEX_OFFSET
+_HISTOGRAM_INDEX_OFFSET = 1 - (_HISTOGRAM_MIN_EXP + 1) * _HISTOGRAM_SUB_BUCKETS
+
+
+class _Histogram:
+    """Log-linear histogram of non-negative values, e.g. durations.
+
+    Quantiles are reported as the midpoint of their bucket, which is within
+    1/(2 * _HISTOGRAM_SUB_BUCKETS) (about 3%) of the true value inside the
+    bucketed range. counts only grows up to the highest bucket used, so
+    add() allocates nothing once a value range has been seen.
+    """
+
+    __slots__ = ("counts",)
+
+    QUANTILES = (0.5, 0.9, 0.99)
+
+    def __init__(self, counts: list[int] | None = None) -> None:
+        self.counts: list[int] = counts if counts is not None else []
+
+    def __repr__(self) -> str:
+        return f"_Histogram(count={sum(self.counts)})"
+
+    def add(self, value: float) -> None:
+        if value < _HISTOGRAM_LOWEST:
+            index = 0
+        else:
+            mantissa, exponent = math.frexp(value)
+            index = (
+                int(mantissa * (2 * _HISTOGRAM_SUB_BUCKETS))
+                + exponent * _HISTOGRAM_SUB_BUCKETS
+                + _HISTOGRAM_INDEX_OFFSET
+            )
+            if index >= _HISTOGRAM_BUCKETS:
+                index = _HISTOGRAM_BUCKETS - 1
+        counts = self.counts
+        if index >= len(counts):
+            counts.extend([0] * (index + 1 - len(counts)))
+        counts[index] += 1
+
+    def merge(self, other: _Histogram) -> _Histogram:
+        """Add other's counts into this histogram and return it."""
+        counts = self.counts
+        other_counts = other.counts
+        if len(other_counts) > len(counts):
+            counts.extend([0] * (len(other_counts) - len(counts)))
+        for index, count in enumerate(other_counts):
+            if count:
+                counts[index] += count
+        return self
+
+    def copy(self) -> _Histogram:
+        return _Histogram(self.counts.copy())
+
+    @staticmethod
+    def _bucket_value(index: int) -> float:
+        if index == 0:
+            return _HISTOGRAM_LOWEST / 2
+        exponent, sub_bucket = divmod(index - 1, _HISTOGRAM_SUB_BUCKETS)
+        return math.ldexp(
+            0.5 + (sub_bucket + 0.5) / (2 * _HISTOGRAM_SUB_BUCKETS),
+            exponent + _HISTOGRAM_MIN_EXP,
+        )
+
+    def quantile(self, q: float) -> float:
+        """Estimate the q-quantile (0 <= q <= 1); 0.0 if nothing was added."""
+        target = q * sum(self.counts)
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if count and seen >= target:
+                return self._bucket_value(index)
+        return 0.0
+
+    def _summarize(self, key: str) -> list[tuple[str, float]]:
+        """Result keys this value expands to in get_result."""
+        return [(f"{key}.p{round(q * 100)}", self.quantile(q)) for q in self.QUANTILES]
+
+
+class _Summary:
+    """Count, sum, mean, min, max and standard deviation of values.
+
+    Keeps the running mean and sum of squared deviations (Welford) rather
+    than a raw sum of squares, so the deviation stays accurate for large
+    values with little spread; merge combines them exactly (Chan et al.).
+    """
+
+    __slots__ = ("count", "total", "mean", "m2", "min", "max")
+
+    def __init__(self) -> None:
+        self.count = 0
+        self.total: float = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def __repr__(self) -> str:
+        return f"_Summary(count={self.count}, mean={self.mean})"
+
+    def add(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def merge(self, other: _Summary) -> _Summary:
+        """Combine other's values into this summary and return it."""
+        if not other.count:
+            return self
+        count = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / count
+        self.m2 += other.m2 + delta * delta * self.count * other.count / count
+        self.count = count
+        self.total += other.total
+        if other.min < self.min:
+            self.min = other.min
+        if other.max > self.max:
+            self.max = other.max
+        return self
+
+    def copy(self) -> _Summary:
+        summary = _Summary()
+        summary.merge(self)
+        return summary
+
+    def _summarize(self, key: str) -> list[tuple[str, float]]:
+        """Result keys this value expands to in get_result."""
+        count = self.count
+        if not count:
+            return [(f"{key}.count", 0)]
+        return [
+            (f"{key}.count", count),
+            (f"{key}.sum", self.total),
+            (f"{key}.mean", self.mean),
+            (f"{key}.min", self.min),
+            (f"{key}.max", self.max),
+            (f"{key}.stddev", math.sqrt(self.m2 / count)),
+        ]
+
+
+# Sketch quantiles are within this relative error of the true value
+_SKETCH_RELATIVE_ACCURACY = 0.01
+_SKETCH_GAMMA = (1 + _SKETCH_RELATIVE_ACCURACY) / (1 - _SKETCH_RELATIVE_ACCURACY)
+_SKETCH_INV_LOG_GAMMA = 1 / math.log(_SKETCH_GAMMA)
+# Bins kept per sign. 2048 bins at 1% cover a ratio of about 10**17 between
+# the smallest and largest magnitude before any bins are collapsed.
+_SKETCH_MAX_BINS = 2048
+
+
+class _Sketch:
+    """Mergeable quantile sketch for arbitrary values (DDSketch).
+
+    Values are counted in logarithmic bins of ratio _SKETCH_GAMMA, so every
+    quantile estimate is within _SKETCH_RELATIVE_ACCURACY of the true value.
+    Each sign keeps at most _SKETCH_MAX_BINS bins; beyond that the bins
+    nearest zero are collapsed together, which only affects the accuracy of
+    the smallest magnitudes. Memory is bounded however many values are added,
+    and merging two sketches gives exactly the sketch of both inputs.
+    """
+
+    __slots__ = ("positive", "negative", "zeros")
+
+    QUANTILES = (0.5, 0.9, 0.99)
+
+    def __init__(
+        self,
+        positive: dict[int, int] | None = None,
+        negative: dict[int, int] | None = None,
+        zeros: int = 0,
+    ) -> None:
+        # bin index -> count; bin i holds magnitudes in (gamma**(i-1), gamma**i]
+        self.positive: dict[int, int] = positive if positive is not None else {}
+        self.negative: dict[int, int] = negative if negative is not None else {}
+        self.zeros = zeros
+
+    def __repr__(self) -> str:
+        return f"_Sketch(count={self.count})"
+
+    @property
+    def count(self) -> int:
+        return sum(self.positive.values()) + sum(self.negative.values()) + self.zeros
+
+    def add(self, value: float) -> None:
+        if value > 0:
+            bins = self.positive
+        elif value < 0:
+            bins = self.negative
+            value = -value
+        elif value == 0:
+            self.zeros += 1
+            return
+        else:
+            raise ValueError(f"Cannot observe a non-finite value: {value!r}")
+        try:
+            index = math.ceil(math.log(value) * _SKETCH_INV_LOG_GAMMA)
+        except OverflowError:
+            raise ValueError(f"Cannot observe a non-finite value: {value!r}") from None
+        if index in bins:
+            bins[index] += 1
+        else:
+            bins[index] = 1
+            if len(bins) > _SKETCH_MAX_BINS:
+                self._collapse(bins)
+
+    @staticmethod
+    def _collapse(bins: dict[int, int]) -> None:
+        """Fold the bins nearest zero together until at most the limit remain."""
+        indexes = sorted(bins)
+        excess = len(indexes) - _SKETCH_MAX_BINS
+        lowest_kept = indexes[excess]
+        bins[lowest_kept] += sum(bins.pop(index) for index in indexes[:excess])
+
+    def merge(self, other: _Sketch) -> _Sketch:
+        """Add other's counts into this sketch and return it."""
+        for bins, other_bins in (
+            (self.positive, other.positive),
+            (self.negative, other.negative),
+        ):
+            for index, count in other_bins.items():
+                bins[index] = bins.get(index, 0) + count
+            if len(bins) > _SKETCH_MAX_BINS:
+                self._collapse(bins)
+        self.zeros += other.zeros
+        return self
+
+    def copy(self) -> _Sketch:
+        return _Sketch(self.positive.copy(), self.negative.copy(), self.zeros)
+
+    @staticmethod
+    def _bin_value(index: int) -> float:
+        return 2 * _SKETCH_GAMMA**index / (_SKETCH_GAMMA + 1)
+
+    def quantile(self, q: float) -> float:
+        """Estimate the q-quantile (0 <= q <= 1); 0.0 if nothing was added."""
+        rank = q * (self.count - 1)
+        seen = 0
+        # Ascending order: most negative values first
+        for index in sorted(self.negative, reverse=True):
+            seen += self.negative[index]
+            if seen > rank:
+                return -self._bin_value(index)
+        seen += self.zeros
+        if seen > rank:
+            return 0.0
+        for index in sorted(self.positive):
+            seen += self.positive[index]
+            if seen > rank:
+                return self._bin_value(index)
+        return 0.0
+
+    def _summarize(self, key: str) -> list[tuple[str, float]]:
+        """Result keys this value expands to in get_result."""
+        return [(f"{key}.p{round(q * 100)}", self.quantile(q)) for q in self.QUANTILES]
+
+
+def _merge_kind_value(kind: int, current: Any, value: Any) -> Any:
+    """Combine two values of the same series, e.g. a nested scope's into its
+    parent's or one recording's into the Recorder's."""
+    if kind >= _HISTOGRAM:
+        return current.merge(value)
+    if kind == _GAUGE:
+        return value
+    if kind == _MAX:
+        return value if value > current else current
+    if kind == _MIN:
+        return value if value < current else current
+    return current + value
+
+
+def _aggregate_kind_value(kind: int, total: Any, value: Any) -> Any:
+    """Combine the values of different tag sets of one key into its result.
+
+    Gauges are summed here (e.g. the depth of every queue), max and min keep
+    their extreme value and histograms are merged.
+    """
+    if kind >= _MAX:
+        return _merge_kind_value(kind, total, value)
+    return total + value
+
+
+def _adopt_kind_value(kind: int, value: Any) -> Any:
+    """Value to store for a series new to a collector or result.
+
+    Objects are copied so a merge never mutates data another collector (or
+    Recorder) still holds.
+    """
+    return value.copy() if kind >= _HISTOGRAM else value
+
+
+def _aggregate_series(
+    series: Iterable[tuple[str, _TagsTuple, int | float]],
+    kinds: dict[str, int] | None,
+) -> dict[str, int | float]:
+    """Combine (key, tags_tuple, value) triples into one value per key."""
+    result: dict[str, int | float] = {}
+    if not kinds:
+        for key, _, value in series:
+            result[key] = result.get(key, 0) + value
+        return result
+
+    for key, _, value in series:
+        kind = kinds.get(key, _COUNTER)
+        if key in result:
+            result[key] = _aggregate_kind_value(kind, result[key], value)
+        else:
+            result[key] = _adopt_kind_value(kind, value)
+    return result
+
+
+def _expand_objects(
+    result: dict[str, Any], kinds: dict[str, int] | None
+) -> dict[str, Any]:
+    """Replace histogram values with the result keys they summarize to."""
+    if not kinds or not any(kinds.get(key, _COUNTER) >= _HISTOGRAM for key in result):
+        return result
+    expanded: dict[str, Any] = {}
+    for key, value in result.items():
+        if kinds.get(key, _COUNTER) >= _HISTOGRAM:
+            expanded.update(value._summarize(key))
+        else:
+            expanded[key] = value
+    return expanded
+
+
+def _drop_empty_counters(
+    result: dict[str, int | float], kinds: dict[str, int] | None
+) -> dict[str, int | float]:
+    """Filtered results leave out counters that did not add up to anything."""
+    if not kinds:
+        return {key: total for key, total in result.items() if total > 0}
+    return {
+        key: total for key, total in result.items() if key in kinds or total > 0
+    }
 
 
 def _get_filtered_stats(
-    data: dict[str, dict[tuple[tuple[str, str | bool], ...], int | float]],
+    series: Iterable[tuple[str, _TagsTuple, int | float]],
     tag_filter: Tags | None,
+    kinds: dict[str, int] | None = None,
 ) -> dict[str, int | float]:
-    """Shared logic for filtering stats by tags."""
-    result: dict[str, int | float] = {}
-    filter_items = set(tag_filter.items()) if tag_filter else None
+    """Shared logic for filtering stats by tags.
 
-    for key, tags_data in data.items():
-        total: int | float = 0
-        for tags_tuple, count in tags_data.items():
-            if filter_items is None or filter_items.issubset(set(tags_tuple)):
-                total += count
-        if total > 0 or filter_items is None:
-            result[key] = total
+    Takes (key, tags_tuple, value) triples so every storage engine can share it.
+    """
+    if not tag_filter:
+        return _expand_objects(_aggregate_series(series, kinds), kinds)
 
-    return result
+    filter_items = set(tag_filter.items())
+    result = _aggregate_series(
+        (item for item in series if filter_items.issubset(item[1])), kinds
+    )
+    return _expand_objects(_drop_empty_counters(result, kinds), kinds)
 
 
-class _StatsCollector:
-    """Temporary collector for stats within a context."""
+# Released storage each engine keeps for reuse by later scopes
+_DEFAULT_COLLECTOR_POOL_SIZE = 64
+
+# Per-key dicts a released _KeyData keeps for the keys its next scope is
+# likely to write again
+_MAX_SPARE_KEYS = 256
 
-    __slots__ = ("_data",)
+
+class _KeyData(dict):  # type: ignore[type-arg]
+    """{key: {tags_tuple: value}} storage of the nested engine.
+
+    Works like defaultdict, except that missing keys first reuse the
+    cleared per-key dict kept in spare when the storage was last released.
+    """
+
+    __slots__ = ("spare",)
 
     def __init__(self) -> None:
-        self._data: dict[str, dict[tuple[tuple[str, str | bool], ...], int | float]] = (
-            defaultdict(lambda: defaultdict(int))
-        )
+        super().__init__()
+        self.spare: dict[str, defaultdict[_TagsTuple, int | float]] = {}
+
+    def __missing__(self, key: str) -> defaultdict[_TagsTuple, int | float]:
+        tags_data = self.spare.pop(key, None)
+        if tags_data is None:
+            tags_data = defaultdict(int)
+        self[key] = tags_data
+        return tags_data
+
+    def release(self) -> None:
+        """Clear all values, keeping the per-key dicts of this use as spares."""
+        spare = self.spare
+        spare.clear()
+        for key, tags_data in self.items():
+            if len(spare) >= _MAX_SPARE_KEYS:
+                break
+            tags_data.clear()
+            spare[key] = tags_data
+        self.clear()
+
+
+class _Collector:
+    """Interface shared by the storage engines behind record().
+
+    Subclasses own the actual storage and implement _add, _slot, _get,
+    _merge_value, _items and _is_empty. merge_into here is the generic
+    fallback used when merging between two different engines, or when the
+    source holds gauge, max or min keys.
+
+    Storage slots are left unset by __init__ and allocated by __getattr__ on
+    first access (which also sets _allocated), so a scope that never records
+    anything never builds them. Once set, slot access never reaches
+    __getattr__ and the hot path pays nothing for the laziness. Storage is
+    taken from the engine's _pool when possible, and _release returns it
+    there once a scope's data has been merged or discarded. The pool
+    holds storage rather than collectors because Counter and Timer cache
+    slots by collector identity, so every scope still gets a new collector.
+    _release also clears _allocated, which those caches check, so a late
+    write (from a task or generator finalizer that outlives its scope)
+    re-resolves into storage of its own and is dropped, instead of landing
+    in whichever scope took the released storage.
+
+    When a nested scope exits, its series are merged into the parent's
+    collector, so every collector holds its scope's full data, nested scopes
+    included, in O(distinct series).
+    """
+
+    __slots__ = (
+        "_allocated",
+        "_kinds",
+        "_spans",
+        "_duration",
+        "_sample_rate",
+    )
+
+    # Set when the scope exits
+    _duration: float
+    _sample_rate: float | None
+
+    # Released storage, shared by every collector of an engine
+    _pool: deque[Any]
+
+    def __init__(self) -> None:
+        self._allocated = False
+        # key -> kind for every key that is not a counter
+        self._kinds: dict[str, int] | None = None
+        # Set for scopes recorded with trace=True, and shared with scopes
+        # nested inside them
+        self._spans: _SpanBuffer | None = None
+
+    def _add(self, key: str, tags_tuple: _TagsTuple, amount: int | float) -> None:
+        raise NotImplementedError
+
+    def _slot(
+        self, key: str, tags_tuple: _TagsTuple
+    ) -> tuple[_SlotStorage, Any]:
+        """Return (mapping, subkey) such that mapping[subkey] += n adds to a series."""
+        raise NotImplementedError
+
+    def _get(self, key: str, tags_tuple: _TagsTuple) -> int | float:
+        raise NotImplementedError
+
+    def _lookup(self, key: str, tags_tuple: _TagsTuple) -> Any:
+        """Like _get, but returns None instead of creating a missing series."""
+        raise NotImplementedError
+
+    def _merge_value(
+        self,
+        key: str,
+        tags_tuple: _TagsTuple,
+        value: int | float,
+        kind: int = _COUNTER,
+    ) -> bool:
+        """Merge one series value in. Returns True if the series was new."""
+        raise NotImplementedError
+
+    def _items(self) -> Iterator[tuple[str, _TagsTuple, int | float]]:
+        raise NotImplementedError
+
+    def _is_empty(self) -> bool:
+        """True if nothing was written here, without allocating the storage."""
+        raise NotImplementedError
+
+    def _release(self) -> None:
+        """Clear the storage and return it to the pool. Must be the last use."""
+        raise NotImplementedError
+
+    def _declare(self, key: str, kind: int) -> None:
+        kinds = self._kinds
+        if kinds is None:
+            kinds = self._kinds = {}
+        current = kinds.setdefault(key, kind)
+        if current != kind:
+            raise ValueError(
+                f"{key!r} is already recorded as a {_KIND_NAMES[current]}, "
+                f"not a {_KIND_NAMES[kind]}"
+            )
+
+    def _adopt_kinds(self, kinds: dict[str, int]) -> None:
+        """Take on the kinds of merged-in keys; kinds already set here win."""
+        own = self._kinds
+        if own is None:
+            self._kinds = dict(kinds)
+        else:
+            for key, kind in kinds.items():
+                own.setdefault(key, kind)
+
+    def _update(
+        self, key: str, tags_tuple: _TagsTuple, value: int | float, kind: int
+    ) -> None:
+        """Write a gauge, max or min value."""
+        kinds = self._kinds
+        if kinds is None or kinds.get(key) != kind:
+            self._declare(key, kind)
+        self._merge_value(key, tags_tuple, value, kind)
+
+    def _object(
+        self,
+        key: str,
+        tags_tuple: _TagsTuple,
+        kind: int,
+        factory: Callable[[], Any],
+    ) -> Any:
+        """Return the object held by a histogram-like series, creating it if needed."""
+        kinds = self._kinds
+        if kinds is None or kinds.get(key) != kind:
+            self._declare(key, kind)
+        value = self._lookup(key, tags_tuple)
+        if value is None:
+            self._merge_value(key, tags_tuple, factory(), kind)
+            value = self._get(key, tags_tuple)
+        return value
 
     def increment(
-        self, key: str, tags: Tags | None = None, amount: int | float = 1
+        self, key: str, tags: Tags | TagSet | None = None, amount: int | float = 1
+    ) -> None:
+        self._add(key, _normalize_tags(tags), amount)
+
+    def set(
+        self, key: str, tags: Tags | TagSet | None = None, value: int | float = 0
     ) -> None:
-        tags_tuple = () if not tags else _normalize_tags(tags)
+        self._update(key, _normalize_tags(tags), value, _GAUGE)
+
+    def get(
+        self, key: str, tags: Tags | TagSet | None = None, default: Any = 0
+    ) -> Any:
+        """Value of one series in this scope, including its nested scopes.
+
+        Meant for record(keep_if=...) predicates. Returns default if the
+        series was never recorded.
+        """
+        if self._is_empty():
+            return default
+        value = self._lookup(key, _normalize_tags(tags))
+        return default if value is None else value
+
+    def merge_into(
+        self,
+        target: _Collector,
+        new_series: list[_Series] | None = None,
+    ) -> None:
+        """Merge this collector's data into another collector.
+
+        Series that did not exist in target yet are appended to new_series.
+        """
+        kinds = self._kinds
+        if not kinds:
+            for key, tags_tuple, value in self._items():
+                if (
+                    target._merge_value(key, tags_tuple, value)
+                    and new_series is not None
+                ):
+                    new_series.append((key, tags_tuple))
+            return
+
+        target._adopt_kinds(kinds)
+        for key, tags_tuple, value in self._items():
+            kind = kinds.get(key, _COUNTER)
+            if (
+                target._merge_value(key, tags_tuple, value, kind)
+                and new_series is not None
+            ):
+                new_series.append((key, tags_tuple))
+
+    def get_stats(self, tag_filter: Tags | None = None) -> dict[str, int | float]:
+        return _get_filtered_stats(self._items(), tag_filter, self._kinds)
+
+
+class _StatsCollector(_Collector):
+    """Temporary collector for stats within a context.
+
+    Default storage engine: {key: {tags_tuple: value}}.
+    """
+
+    __slots__ = ("_data",)
+
+    _data: _KeyData
+    _pool: deque[_KeyData] = deque(maxlen=_DEFAULT_COLLECTOR_POOL_SIZE)
+
+    def __getattr__(self, name: str) -> Any:
+        if name == "_data":
+            self._allocated = True
+            try:
+                data = self._pool.pop()
+            except IndexError:
+                data = _KeyData()
+            self._data = data
+            return data
+        raise AttributeError(name)
+
+    def _is_empty(self) -> bool:
+        return not (self._allocated and self._data)
+
+    def _release(self) -> None:
+        if self._allocated:
+            data = self._data
+            del self._data
+            self._allocated = False
+            data.release()
+            self._pool.append(data)
+
+    def _add(self, key: str, tags_tuple: _TagsTuple, amount: int | float) -> None:
         self._data[key][tags_tuple] += amount
 
-    def set(self, key: str, tags: Tags | None = None, value: int | float = 0) -> None:
-        tags_tuple = () if not tags else _normalize_tags(tags)
-        self._data[key][tags_tuple] = value
+    def _slot(
+        self, key: str, tags_tuple: _TagsTuple
+    ) -> tuple[_SlotStorage, Any]:
+        return self._data[key], tags_tuple
+
+    def _get(self, key: str, tags_tuple: _TagsTuple) -> int | float:
+        return self._data[key][tags_tuple]
+
+    def _lookup(self, key: str, tags_tuple: _TagsTuple) -> Any:
+        key_data = self._data.get(key)
+        return None if key_data is None else key_data.get(tags_tuple)
+
+    def _merge_value(
+        self,
+        key: str,
+        tags_tuple: _TagsTuple,
+        value: int | float,
+        kind: int = _COUNTER,
+    ) -> bool:
+        key_data = self._data[key]
+        if tags_tuple in key_data:
+            key_data[tags_tuple] = _merge_kind_value(kind, key_data[tags_tuple], value)
+            return False
+        key_data[tags_tuple] = _adopt_kind_value(kind, value)
+        return True
+
+    def _items(self) -> Iterator[tuple[str, _TagsTuple, int | float]]:
+        return (
+            (key, tags_tuple, value)
+            for key, tags_data in self._data.items()
+            for tags_tuple, value in tags_data.items()
+        )
+
+    def merge_into(
+        self,
+        target: _Collector,
+        new_series: list[_Series] | None = None,
+    ) -> None:
+        if target.__class__ is not _StatsCollector or self._kinds:
+            return super().merge_into(target, new_series)
 
-    def merge_into(self, target: _StatsCollector) -> None:
-        """Merge this collector's data into another collector."""
+        target_data = target._data  # type: ignore[attr-defined]
         for key, tags_data in self._data.items():
-            target_key_data = target._data[key]
+            target_key_data = target_data[key]
+            if new_series is None:
+                for tags_tuple, amount in tags_data.items():
+                    target_key_data[tags_tuple] += amount
+                continue
             for tags_tuple, amount in tags_data.items():
-                target_key_data[tags_tuple] += amount
+                if tags_tuple in target_key_data:
+                    target_key_data[tags_tuple] += amount
+                else:
+                    target_key_data[tags_tuple] = amount
+                    new_series.append((key, tags_tuple))
 
-    def get_stats(self, tag_filter: Tags | None = None) -> dict[str, int | float]:
-        return _get_filtered_stats(self._data, tag_filter)
 
+class _FlatStatsCollector(_Collector):
+    """Storage engine keyed by (key, tags_tuple) in a single dict.
+
+    Avoids the per-key inner dict (and its default factory) of the nested
+    layout, at the cost of building a (key, tags_tuple) tuple per write.
+    """
+
+    __slots__ = ("_data",)
+
+    _data: defaultdict[_Series, int | float]
+    _pool: deque[defaultdict[_Series, int | float]] = deque(
+        maxlen=_DEFAULT_COLLECTOR_POOL_SIZE
+    )
+
+    def __getattr__(self, name: str) -> Any:
+        if name == "_data":
+            self._allocated = True
+            try:
+                data = self._pool.pop()
+            except IndexError:
+                data = defaultdict(int)
+            self._data = data
+            return data
+        raise AttributeError(name)
+
+    def _is_empty(self) -> bool:
+        return not (self._allocated and self._data)
+
+    def _release(self) -> None:
+        if self._allocated:
+            data = self._data
+            del self._data
+            self._allocated = False
+            data.clear()
+            self._pool.append(data)
+
+    def _add(self, key: str, tags_tuple: _TagsTuple, amount: int | float) -> None:
+        self._data[(key, tags_tuple)] += amount
+
+    def _slot(
+        self, key: str, tags_tuple: _TagsTuple
+    ) -> tuple[_SlotStorage, Any]:
+        return self._data, (key, tags_tuple)
+
+    def _get(self, key: str, tags_tuple: _TagsTuple) -> int | float:
+        return self._data[(key, tags_tuple)]
+
+    def _lookup(self, key: str, tags_tuple: _TagsTuple) -> Any:
+        return self._data.get((key, tags_tuple))
+
+    def _merge_value(
+        self,
+        key: str,
+        tags_tuple: _TagsTuple,
+        value: int | float,
+        kind: int = _COUNTER,
+    ) -> bool:
+        series = (key, tags_tuple)
+        data = self._data
+        if series in data:
+            data[series] = _merge_kind_value(kind, data[series], value)
+            return False
+        data[series] = _adopt_kind_value(kind, value)
+        return True
+
+    def _items(self) -> Iterator[tuple[str, _TagsTuple, int | float]]:
+        return (
+            (key, tags_tuple, value)
+            for (key, tags_tuple), value in self._data.items()
+        )
+
+    def merge_into(
+        self,
+        target: _Collector,
+        new_series: list[_Series] | None = None,
+    ) -> None:
+        if target.__class__ is not _FlatStatsCollector or self._kinds:
+            return super().merge_into(target, new_series)
+
+        target_data = target._data  # type: ignore[attr-defined]
+        for series, amount in self._data.items():
+            if series in target_data:
+                target_data[series] += amount
+            else:
+                target_data[series] = amount
+                if new_series is not None:
+                    new_series.append(series)
 
-class Recorder:
-    """Records statistics during context blocks. Use with record() context manager."""
 
-    __slots__ = ("_data", "_has_recorded")
+class _SeriesRegistry:
+    """Process-wide assignment of small integer slots to series.
+
+    Slots are never released, so this suits a bounded set of metrics rather
+    than unbounded tag cardinality.
+    """
+
+    __slots__ = ("_slots", "series", "_lock")
 
     def __init__(self) -> None:
-        self._data: dict[str, dict[tuple[tuple[str, str | bool], ...], int | float]] = (
-            defaultdict(lambda: defaultdict(int))
+        self._slots: dict[_Series, int] = {}
+        # slot -> series
+        self.series: list[_Series] = []
+        self._lock = threading.Lock()
+
+    def slot(self, key: str, tags_tuple: _TagsTuple) -> int:
+        series = (key, tags_tuple)
+        slot = self._slots.get(series)
+        if slot is None:
+            with self._lock:
+                slot = self._slots.get(series)
+                if slot is None:
+                    slot = len(self.series)
+                    self.series.append(series)
+                    self._slots[series] = slot
+        return slot
+
+    def __len__(self) -> int:
+        return len(self.series)
+
+
+_series_registry = _SeriesRegistry()
+
+
+class _ArrayStatsCollector(_Collector):
+    """Storage engine holding one list entry per registered series.
+
+    Values are indexed by the slot from _series_registry (None means the
+    series was never written here), and _touched lists the written slots in
+    first-write order, so iterating and merging cost O(touched series).
+    """
+
+    __slots__ = ("_values", "_touched")
+
+    # _values is never rebound once allocated: Counter/Timer slot caches hold
+    # on to the list
+    _values: list[int | float | None]
+    _touched: list[int]
+    _pool: deque[tuple[list[int | float | None], list[int]]] = deque(
+        maxlen=_DEFAULT_COLLECTOR_POOL_SIZE
+    )
+
+    def __getattr__(self, name: str) -> Any:
+        if name == "_values" or name == "_touched":
+            self._allocated = True
+            try:
+                self._values, self._touched = self._pool.pop()
+            except IndexError:
+                self._values = []
+                self._touched = []
+            return getattr(self, name)
+        raise AttributeError(name)
+
+    def _is_empty(self) -> bool:
+        return not (self._allocated and self._touched)
+
+    def _release(self) -> None:
+        if self._allocated:
+            values, touched = self._values, self._touched
+            del self._values, self._touched
+            self._allocated = False
+            for slot in touched:
+                values[slot] = None
+            touched.clear()
+            self._pool.append((values, touched))
+
+    def _ensure(self, slot: int) -> list[int | float | None]:
+        values = self._values
+        if slot >= len(values):
+            values.extend([None] * (len(_series_registry) - len(values)))
+        return values
+
+    def _add(self, key: str, tags_tuple: _TagsTuple, amount: int | float) -> None:
+        slot = _series_registry.slot(key, tags_tuple)
+        values = self._ensure(slot)
+        value = values[slot]
+        if value is None:
+            values[slot] = amount
+            self._touched.append(slot)
+        else:
+            values[slot] = value + amount
+
+    def _slot(self, key: str, tags_tuple: _TagsTuple) -> tuple[_SlotStorage, Any]:
+        slot = _series_registry.slot(key, tags_tuple)
+        values = self._ensure(slot)
+        if values[slot] is None:
+            values[slot] = 0
+            self._touched.append(slot)
+        return values, slot
+
+    def _get(self, key: str, tags_tuple: _TagsTuple) -> int | float:
+        slot = _series_registry.slot(key, tags_tuple)
+        return self._values[slot]  # type: ignore[return-value]
+
+    def _lookup(self, key: str, tags_tuple: _TagsTuple) -> Any:
+        # Reading must not register the series: slots are never released
+        slot = _series_registry._slots.get((key, tags_tuple))
+        if slot is None:
+            return None
+        values = self._values
+        return values[slot] if slot < len(values) else None
+
+    def _merge_value(
+        self,
+        key: str,
+        tags_tuple: _TagsTuple,
+        value: int | float,
+        kind: int = _COUNTER,
+    ) -> bool:
+        slot = _series_registry.slot(key, tags_tuple)
+        values = self._ensure(slot)
+        current = values[slot]
+        if current is None:
+            values[slot] = _adopt_kind_value(kind, value)
+            self._touched.append(slot)
+            return True
+        values[slot] = _merge_kind_value(kind, current, value)
+        return False
+
+    def _items(self) -> Iterator[tuple[str, _TagsTuple, int | float]]:
+        series = _series_registry.series
+        values = self._values
+        for slot in self._touched:
+            key, tags_tuple = series[slot]
+            yield key, tags_tuple, values[slot]  # type: ignore[misc]
+
+    def merge_into(
+        self,
+        target: _Collector,
+        new_series: list[_Series] | None = None,
+    ) -> None:
+        if target.__class__ is not _ArrayStatsCollector or self._kinds:
+            return super().merge_into(target, new_series)
+
+        # Element-wise addition over the slots this collector touched
+        values = self._values
+        target_values = target._ensure(len(values) - 1)  # type: ignore[attr-defined]
+        target_touched = target._touched  # type: ignore[attr-defined]
+        series = _series_registry.series
+        for slot in self._touched:
+            current = target_values[slot]
+            if current is None:
+                target_values[slot] = values[slot]
+                target_touched.append(slot)
+                if new_series is not None:
+                    new_series.append(series[slot])
+            else:
+                target_values[slot] = current + values[slot]
+
+
+_DEFAULT_MAX_SPANS = 10000
+
+
+class Span(NamedTuple):
+    """One timed call captured by record(trace=True)."""
+
+    key: str
+    tags: Tags
+    start_ns: int
+    end_ns: int
+    thread_id: int
+    # id() of the asyncio task the call ran in, if any
+    task_id: int | None
+
+
+def _current_task() -> Any:
+    # Only look for a task if asyncio is in use at all
+    asyncio = sys.modules.get("asyncio")
+    if asyncio is None:
+        return None
+    try:
+        return asyncio.current_task()
+    except RuntimeError:
+        return None
+
+
+class _SpanBuffer:
+    """Bounded list of spans for a traced scope.
+
+    Spans are raw tuples of Span's fields, plus the task name, timed on the
+    perf_counter_ns clock. Once max_spans are held, further spans are counted
+    in dropped instead, so a trace keeps the start of a long scope.
+    """
+
+    __slots__ = ("spans", "max_spans", "dropped", "recorder")
+
+    def __init__(self, max_spans: int, recorder: Recorder) -> None:
+        self.spans: list[tuple[Any, ...]] = []
+        self.max_spans = max_spans
+        self.dropped = 0
+        # The recorder whose get_spans() reports this buffer
+        self.recorder = recorder
+
+    def add(
+        self,
+        key: str,
+        tags_tuple: _TagsTuple,
+        duration_secs: float,
+        start: float | None = None,
+    ) -> None:
+        """Add a span that ends now.
+
+        start is the perf_counter() time the span began. Without it, the span
+        is taken to have lasted duration_secs, which only holds for wall time.
+        """
+        spans = self.spans
+        if len(spans) >= self.max_spans:
+            self.dropped += 1
+            return
+        end_ns = time.perf_counter_ns()
+        task = _current_task()
+        spans.append(
+            (
+                key,
+                tags_tuple,
+                end_ns - round(duration_secs * 1e9)
+                if start is None
+                else round(start * 1e9),
+                end_ns,
+                threading.get_ident(),
+                None if task is None else id(task),
+                None if task is None else task.get_name(),
+            )
         )
-        self._has_recorded = False
 
-    @contextmanager
-    def record(self) -> Generator[None, None, None]:
-        """Context manager for recording statistics. Automatically adds total_recording_duration."""
-        # Create collector for this context
-        collector = _StatsCollector()
+    def extend(self, other: _SpanBuffer) -> None:
+        room = self.max_spans - len(self.spans)
+        self.spans.extend(other.spans[:room])
+        self.dropped += other.dropped + max(0, len(other.spans) - room)
 
-        # Get parent collector and set ours as current
-        parent_collector = _current_collector.get()
-        context_token = _current_collector.set(collector)
 
-        # Track total recording duration
-        start_time = time.perf_counter()
+# Finished scopes a Recorder queues before merging them eagerly, which bounds
+# the memory held by recorders that are recorded into but rarely read
+_MAX_PENDING_SCOPES = 64
+
+_STORAGE_ENGINES: dict[str, type[_Collector]] = {
+    "nested": _StatsCollector,
+    "flat": _FlatStatsCollector,
+    "array": _ArrayStatsCollector,
+}
+
+
+def set_collector_pool_size(maxsize: int) -> None:
+    """Bound how many released collector storages each engine keeps for reuse.
+
+    Scopes take their storage from the pool instead of allocating it, so
+    steady-state recording allocates almost nothing. A size of 0 disables
+    pooling.
+    """
+    if maxsize < 0:
+        raise ValueError(f"maxsize must be >= 0, got {maxsize!r}")
+    for engine in _STORAGE_ENGINES.values():
+        engine._pool = deque(maxlen=maxsize)
+
 
+class Recorder:
+    """Records statistics during context blocks. Use with record() context manager.
+
+    Args:
+        storage: Storage engine for this recorder and the collectors it
+            creates: "nested" (default), "flat" or "array". Results are
+            identical.
+    """
+
+    __slots__ = (
+        "_store",
+        "_index",
+        "_key_order",
+        "_has_recorded",
+        "_pending",
+        "_lock",
+        "_span_buffers",
+    )
+
+    def __init__(self, storage: str = "nested") -> None:
         try:
-            yield
-        finally:
-            end_time = time.perf_counter()
-            recording_duration = end_time - start_time
+            engine = _STORAGE_ENGINES[storage]
+        except KeyError:
+            raise ValueError(
+                f"Unknown storage engine {storage!r}, "
+                f"expected one of {sorted(_STORAGE_ENGINES)}"
+            ) from None
+        self._store = engine()
+        # Each recording reports its own duration rather than a running sum
+        self._store._declare("total_recording_duration", _GAUGE)
+        # Inverted index: (tag_key, tag_value) -> series carrying that tag, in
+        # the order the series were first recorded
+        self._index: dict[tuple[str, str | bool], dict[_Series, None]] = (
+            defaultdict(dict)
+        )
+        # Position of each key in first-recorded order
+        self._key_order: dict[str, int] = {}
+        self._has_recorded = False
+        # Finished collectors not yet merged into _store
+        self._pending: deque[_Collector] = deque()
+        self._lock = threading.Lock()
+        # One per scope recorded with trace=True
+        self._span_buffers: list[_SpanBuffer] = []
+
+    def record(
+        self,
+        trace: bool = False,
+        max_spans: int = _DEFAULT_MAX_SPANS,
+        sample_rate: float | None = None,
+        sample_key: object = None,
+        keep_if: Callable[[float, _Collector], bool] | None = None,
+        min_duration: float | None = None,
+    ) -> _RecordingScope:
+        """Context manager for recording statistics. Automatically adds total_recording_duration.
+
+        With trace=True, every timed call in the scope (including nested
+        scopes) is also kept as a span, up to max_spans per scope; see
+        get_spans and export_chrome_trace.
+
+        With sample_rate, only that fraction of scopes is recorded, chosen at
+        random or, if sample_key is given (e.g. a request id), by a hash of
+        it so the same key always gets the same decision. A scope that is
+        not sampled installs no collector, so recording calls inside it are
+        no-ops. Recorded scopes add a sample_rate gauge to the results for
+        extrapolating totals. Scopes nested inside a sampled scope, sampled
+        or not, follow its decision.
+
+        keep_if(duration, collector) and min_duration decide at exit whether
+        the scope's data is kept; collector.get(key, tags) reads what the
+        scope recorded. A scope that fails either check is discarded without
+        any merge work, but still counts towards enclosing scopes.
+        """
+        if sample_rate is not None and not 0 <= sample_rate <= 1:
+            raise ValueError(
+                f"sample_rate must be between 0 and 1, got {sample_rate!r}"
+            )
+        if sample_key is not None and sample_rate is None:
+            raise ValueError("sample_key requires sample_rate")
+        return _RecordingScope(
+            self,
+            max_spans if trace else None,
+            sample_rate,
+            sample_key,
+            keep_if,
+            min_duration,
+        )
+
+    def _finish_scope(
+        self,
+        collector: _Collector,
+        parent_collector: _Collector | None,
+        recording_duration: float,
+        keep: bool = True,
+        sample_rate: float | None = None,
+    ) -> None:
+        """Merge a finished scope into the parent scope and queue it.
 
-            # Add total recording duration to collector
-            collector.set("total_recording_duration", value=recording_duration)
+        The parent merge costs O(distinct series in the scope), since its
+        collector already holds what its own nested scopes recorded. Our
+        storage only takes the queued collector when results are read (or
+        the queue fills up), so each recorder reads one collector per scope
+        however deeply scopes nest. A scope that is not kept is still merged
+        into the parent, which may belong to another recorder, but never
+        queued.
 
-            # Store collector data in our storage
-            self._merge_collector(collector)
-            self._has_recorded = True
+        Like the duration, the sample rate of a sampled scope is kept aside
+        and only reported by this recorder, never by enclosing ones.
+        """
+        collector._duration = recording_duration
+        collector._sample_rate = sample_rate
+        if parent_collector is not None and not collector._is_empty():
+            collector.merge_into(parent_collector)
+        if not keep:
+            collector._release()
+            return
 
-            # Restore parent context
-            _current_collector.reset(context_token)
+        pending = self._pending
+        pending.append(collector)
+        self._has_recorded = True
+        if len(pending) >= _MAX_PENDING_SCOPES:
+            self._flush()
 
-            # Merge into parent if it exists
-            if parent_collector is not None:
-                collector.merge_into(parent_collector)
+    def _flush(self) -> None:
+        """Merge every queued scope into our storage."""
+        pending = self._pending
+        if not pending:
+            return
+        with self._lock:
+            store = self._store
+            new_series: list[_Series] = []
+            while pending:
+                try:
+                    collector = pending.popleft()
+                except IndexError:
+                    break
+                if not collector._is_empty():
+                    collector.merge_into(store, new_series)
+                if store._merge_value(
+                    "total_recording_duration", (), collector._duration, _GAUGE
+                ):
+                    new_series.append(("total_recording_duration", ()))
+                sample_rate = collector._sample_rate
+                if sample_rate is not None:
+                    store._declare("sample_rate", _GAUGE)
+                    if store._merge_value("sample_rate", (), sample_rate, _GAUGE):
+                        new_series.append(("sample_rate", ()))
+                # The parent scope took its copy when this one exited, so
+                # nothing else reads this collector any more
+                collector._release()
+            if new_series:
+                self._index_series(new_series)
 
-    def _merge_collector(self, collector: _StatsCollector) -> None:
+    def _merge_collector(self, collector: _Collector) -> None:
         """Merge collector data into our final storage."""
-        for key, tags_data in collector._data.items():
-            final_key_data = self._data[key]
-            for tags_tuple, amount in tags_data.items():
-                final_key_data[tags_tuple] += amount
+        new_series: list[_Series] = []
+        collector.merge_into(self._store, new_series)
+        if new_series:
+            self._index_series(new_series)
+
+    def _index_series(self, new_series: list[_Series]) -> None:
+        """Add series seen for the first time to the tag index and key order."""
+        index = self._index
+        key_order = self._key_order
+        for series in new_series:
+            key, tags_tuple = series
+            if key not in key_order:
+                key_order[key] = len(key_order)
+            for item in tags_tuple:
+                index[item][series] = None
+
+    def _indexed_series(self, tag_filter: Tags) -> list[_Series]:
+        """Series carrying every tag in tag_filter, in first-recorded order."""
+        postings = []
+        for item in tag_filter.items():
+            series_for_item = self._index.get(item)
+            if not series_for_item:
+                return []
+            postings.append(series_for_item)
+        postings.sort(key=len)
+        smallest, others = postings[0], postings[1:]
+        if not others:
+            return list(smallest)
+        return [s for s in smallest if all(s in other for other in others)]
 
+    def _get_indexed_stats(self, tag_filter: Tags) -> dict[str, int | float]:
+        """Same result as _get_filtered_stats, answered from the tag index."""
+        # Walk matches in insertion order so per-key sums accumulate in the
+        # same order as a full scan would
+        store = self._store
+        get = store._get
+        totals = _aggregate_series(
+            (
+                (key, tags_tuple, get(key, tags_tuple))
+                for key, tags_tuple in self._indexed_series(tag_filter)
+            ),
+            store._kinds,
+        )
+
+        if len(totals) > 1:
+            # Restore the key order of a full scan
+            key_order = self._key_order
+            totals = {
+                key: totals[key] for key in sorted(totals, key=key_order.__getitem__)
+            }
+        totals = _drop_empty_counters(totals, store._kinds)
+        return _expand_objects(totals, store._kinds)
+
+    def _get_grouped_stats(
+        self, tag_filter: Tags | None, group_by: Sequence[str]
+    ) -> dict[str, dict[tuple[str | bool | None, ...], int | float]]:
+        """Break every key down by the values of the group_by tags in one pass."""
+        store = self._store
+        if tag_filter:
+            series_iter: Iterable[tuple[str, _TagsTuple, int | float]] = (
+                (key, tags_tuple, store._get(key, tags_tuple))
+                for key, tags_tuple in self._indexed_series(tag_filter)
+            )
+        else:
+            series_iter = store._items()
+
+        kinds = store._kinds or {}
+        result: dict[str, dict[tuple[str | bool | None, ...], int | float]] = {}
+        groups: dict[_TagsTuple, tuple[str | bool | None, ...]] = {}
+        for key, tags_tuple, amount in series_iter:
+            group = groups.get(tags_tuple)
+            if group is None:
+                tags = dict(tags_tuple)
+                group = groups[tags_tuple] = tuple(tags.get(name) for name in group_by)
+            key_groups = result.get(key)
+            if key_groups is None:
+                key_groups = result[key] = {}
+            kind = kinds.get(key, _COUNTER)
+            if group in key_groups:
+                key_groups[group] = _aggregate_kind_value(
+                    kind, key_groups[group], amount
+                )
+            else:
+                key_groups[group] = _adopt_kind_value(kind, amount)
+
+        if any(kinds.get(key, _COUNTER) >= _HISTOGRAM for key in result):
+            # Expand histograms per group, as _expand_objects does per key
+            expanded: dict[str, dict[tuple[str | bool | None, ...], Any]] = {}
+            for key, key_groups in result.items():
+                if kinds.get(key, _COUNTER) < _HISTOGRAM:
+                    expanded[key] = key_groups
+                    continue
+                for group, value in key_groups.items():
+                    for name, summary in value._summarize(key):
+                        expanded.setdefault(name, {})[group] = summary
+            result = expanded
+        return result
+
+    @overload
     def get_result(
-        self, tag_filter: Tags | None = None, *, require_recording: bool = False
-    ) -> dict[str, int | float]:
+        self,
+        tag_filter: Tags | None = None,
+        *,
+        group_by: None = None,
+        require_recording: bool = False,
+    ) -> dict[str, int | float]: ...
+
+    @overload
+    def get_result(
+        self,
+        tag_filter: Tags | None = None,
+        *,
+        group_by: Sequence[str],
+        require_recording: bool = False,
+    ) -> dict[str, dict[tuple[str | bool | None, ...], int | float]]: ...
+
+    def get_result(
+        self,
+        tag_filter: Tags | None = None,
+        *,
+        group_by: Sequence[str] | None = None,
+        require_recording: bool = False,
+    ) -> (
+        dict[str, int | float]
+        | dict[str, dict[tuple[str | bool | None, ...], int | float]]
+    ):
         """Get recorded statistics.
 
         Args:
             tag_filter: Only include stats with matching tags
+            group_by: Tag names to break results down by. Returns
+                {key: {(value, ...): total}} with one tuple position per
+                group_by tag; series without that tag land in the None bucket.
             require_recording: Raise ValueError if no recording has occurred
         """
         if require_recording and not self._has_recorded:
             raise ValueError(
                 "No recording has occurred. Use recorder.record() context manager first."
             )
-        return _get_filtered_stats(self._data, tag_filter)
+        self._flush()
+        if group_by is not None:
+            if isinstance(group_by, str):
+                group_by = (group_by,)
+            return self._get_grouped_stats(tag_filter, group_by)
+        if tag_filter:
+            return self._get_indexed_stats(tag_filter)
+        store = self._store
+        return _get_filtered_stats(store._items(), tag_filter, store._kinds)
+
+    def get_quantile(
+        self, key: str, q: float, tag_filter: Tags | None = None
+    ) -> float | None:
+        """Estimate the q-quantile (0 <= q <= 1) of a histogram or observe() key.
+
+        Series of key matching tag_filter are merged first. Returns None if
+        nothing matching was recorded.
+        """
+        if not 0 <= q <= 1:
+            raise ValueError(f"Quantile must be between 0 and 1, got {q!r}")
+        self._flush()
+        store = self._store
+        kind = (store._kinds or {}).get(key)
+        if kind is None:
+            return None
+        if kind not in _QUANTILE_KINDS:
+            raise ValueError(
+                f"{key!r} is a {_KIND_NAMES[kind]}, which has no quantiles"
+            )
+
+        if tag_filter:
+            values: Iterable[Any] = (
+                store._get(series_key, tags_tuple)
+                for series_key, tags_tuple in self._indexed_series(tag_filter)
+                if series_key == key
+            )
+        else:
+            values = (
+                value for series_key, _, value in store._items() if series_key == key
+            )
+        merged: Any = None
+        for value in values:
+            merged = value.copy() if merged is None else merged.merge(value)
+        return None if merged is None else merged.quantile(q)
+
+    def get_spans(self) -> list[Span]:
+        """Spans captured by scopes recorded with trace=True, by start time."""
+        spans = [
+            Span(key, dict(tags_tuple), start_ns, end_ns, thread_id, task_id)
+            for buffer in self._span_buffers
+            for key, tags_tuple, start_ns, end_ns, thread_id, task_id, _ in buffer.spans
+        ]
+        spans.sort(key=lambda span: span.start_ns)
+        return spans
+
+    def export_chrome_trace(self, path: str | None = None) -> dict[str, Any]:
+        """Captured spans in the Chrome trace event format.
+
+        The result loads in Perfetto (ui.perfetto.dev) and chrome://tracing.
+        Spans of asyncio tasks get a track per task. If path is given, the
+        trace is also written there as JSON.
+        """
+        raw = sorted(
+            (span for buffer in self._span_buffers for span in buffer.spans),
+            key=lambda span: span[2],
+        )
+        origin_ns = raw[0][2] if raw else 0
+        pid = os.getpid()
+        events: list[dict[str, Any]] = []
+        track_names: dict[int, str] = {}
+        for key, tags_tuple, start_ns, end_ns, thread_id, task_id, task_name in raw:
+            tid = thread_id if task_id is None else task_id
+            if tid not in track_names:
+                track_names[tid] = (
+                    f"Thread {thread_id}" if task_name is None else task_name
+                )
+            events.append(
+                {
+                    "name": key,
+                    "ph": "X",
+                    "ts": (start_ns - origin_ns) / 1000,
+                    "dur": (end_ns - start_ns) / 1000,
+                    "pid": pid,
+                    "tid": tid,
+                    "args": dict(tags_tuple),
+                }
+            )
+        for tid, name in track_names.items():
+            events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": pid,
+                    "tid": tid,
+                    "args": {"name": name},
+                }
+            )
+        trace = {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {
+                "dropped_spans": sum(b.dropped for b in self._span_buffers)
+            },
+        }
+        if path is not None:
+            with open(path, "w") as f:
+                json.dump(trace, f)
+        return trace
 
     # Keep get_stats for backward compatibility
     def get_stats(self, tag_filter: Tags | None = None) -> dict[str, int | float]:
         return self.get_result(tag_filter)
 
 
-def incr(key: str, tags: Tags | None = None, amount: int | float = 1) -> None:
-    collector = _current_collector.get()
+class _RecordingScope:
+    """Context manager returned by Recorder.record().
+
+    A plain slotted class rather than a @contextmanager generator, which keeps
+    scope enter/exit cheap.
+    """
+
+    __slots__ = (
+        "_recorder",
+        "_max_spans",
+        "_sample_rate",
+        "_sample_key",
+        "_keep_if",
+        "_min_duration",
+        "_sampling_token",
+        "_recorded_rate",
+        "_collector",
+        "_parent",
+        "_token",
+        "_start_time",
+    )
+
+    def __init__(
+        self,
+        recorder: Recorder,
+        max_spans: int | None = None,
+        sample_rate: float | None = None,
+        sample_key: object = None,
+        keep_if: Callable[[float, _Collector], bool] | None = None,
+        min_duration: float | None = None,
+    ) -> None:
+        self._recorder = recorder
+        # None unless the scope is traced
+        self._max_spans = max_spans
+        self._sample_rate = sample_rate
+        self._sample_key = sample_key
+        self._keep_if = keep_if
+        self._min_duration = min_duration
+
+    def __call__(self, func: Callable[P, T]) -> Callable[P, T]:
+        """Use the scope as a decorator, recording each call in its own scope.
+
+        A scope holds the state of one active entry, so every call opens a
+        fresh one with the same arguments.
+        """
+        args = (
+            self._recorder,
+            self._max_spans,
+            self._sample_rate,
+            self._sample_key,
+            self._keep_if,
+            self._min_duration,
+        )
+
+        if inspect.iscoroutinefunction(func):
+            coro_func: Callable[P, Coroutine[Any, Any, Any]] = func
+
+            @functools.wraps(func)
+            async def async_wrapper(*f_args: P.args, **f_kwargs: P.kwargs) -> Any:
+                with _RecordingScope(*args):
+                    return await coro_func(*f_args, **f_kwargs)
+
+            return async_wrapper  # type: ignore[return-value]
+
+        @functools.wraps(func)
+        def wrapper(*f_args: P.args, **f_kwargs: P.kwargs) -> T:
+            with _RecordingScope(*args):
+                return func(*f_args, **f_kwargs)
+
+        return wrapper
+
+    def _sample(self) -> bool:
+        """Decide whether this scope is recorded, or follow an outer decision."""
+        decision = _sampling.get()
+        if decision is None:
+            rate = self._sample_rate
+            assert rate is not None
+            key = self._sample_key
+            if key is None:
+                sampled = random.random() < rate
+            else:
+                sampled = zlib.crc32(str(key).encode()) < rate * 0x100000000
+            decision = (sampled, rate)
+            self._sampling_token = _sampling.set(decision)
+        self._recorded_rate = decision[1]
+        return decision[0]
+
+    def __enter__(self) -> None:
+        self._sampling_token = None
+        self._recorded_rate = None
+        if not _enabled or (
+            (self._sample_rate is not None or _sampling.get() is not None)
+            and not self._sample()
+        ):
+            # Disabled or not sampled: leave the current collector as it is
+            self._collector = None
+            return
+
+        # Create collector for this context; its storage is only allocated
+        # on the first write
+        collector = self._collector = self._recorder._store.__class__()
+
+        # Get parent collector and set ours as current
+        parent = self._parent = _current_collector.get()
+        self._token = _current_collector.set(collector)
+
+        if self._max_spans is not None:
+            buffer = collector._spans = _SpanBuffer(self._max_spans, self._recorder)
+            self._recorder._span_buffers.append(buffer)
+        elif parent is not None and parent._spans is not None:
+            # Untraced scopes add their spans to the enclosing trace
+            collector._spans = parent._spans
+
+        # Track total recording duration
+        self._start_time = time.perf_counter()
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        if self._sampling_token is not None:
+            _sampling.reset(self._sampling_token)
+        collector = self._collector
+        if collector is None:
+            return
+        recording_duration = time.perf_counter() - self._start_time
+
+        # Restore parent context
+        _current_collector.reset(self._token)
+
+        parent = self._parent
+        keep = True
+        try:
+            min_duration, keep_if = self._min_duration, self._keep_if
+            if min_duration is not None and recording_duration < min_duration:
+                keep = False
+            elif keep_if is not None:
+                keep = bool(keep_if(recording_duration, collector))
+        finally:
+            # A keep_if that raises keeps the scope, so it is still linked
+            # and queued before the exception propagates
+            if self._max_spans is not None:
+                spans: _SpanBuffer = collector._spans  # type: ignore[assignment]
+                if not keep:
+                    self._recorder._span_buffers.remove(spans)
+                parent_spans = parent._spans if parent is not None else None
+                # A traced scope inside another traced scope. Its spans already
+                # reach get_spans() of its own recorder through its buffer, so
+                # they are only copied into a parent buffer reported by another
+                # recorder, or when this scope is discarded
+                if parent_spans is not None and (
+                    not keep or parent_spans.recorder is not self._recorder
+                ):
+                    parent_spans.extend(spans)
+
+            self._recorder._finish_scope(
+                collector, parent, recording_duration, keep, self._recorded_rate
+            )
+
+
+def incr(
+    key: str, tags: Tags | TagSet | None = None, amount: int | float = 1
+) -> None:
+    collector = _current_collector.get() if _enabled else None
     if collector:
         # Direct access to avoid method call overhead in hot path
-        tags_tuple = () if not tags else _normalize_tags(tags)
-        collector._data[key][tags_tuple] += amount
+        if not tags:
+            tags_tuple: _TagsTuple = ()
+        elif tags.__class__ is TagSet:
+            tags_tuple = tags  # type: ignore[assignment]
+        else:
+            tags_tuple = _normalize_tags(tags)
+        if collector.__class__ is _StatsCollector:
+            collector._data[key][tags_tuple] += amount  # type: ignore[attr-defined]
+        else:
+            collector._add(key, tags_tuple, amount)
+
+
+def incr_many(
+    updates: Mapping[str, int | float] | Iterable[tuple[str, int | float]],
+    tags: Tags | TagSet | None = None,
+) -> None:
+    """Increment several keys at once, like one incr() per (key, amount).
+
+    updates is a mapping or an iterable of (key, amount) pairs, and tags
+    apply to every key. The collector and tags are only resolved once.
+    """
+    collector = _current_collector.get() if _enabled else None
+    if collector:
+        tags_tuple = _normalize_tags(tags)
+        items = updates.items() if isinstance(updates, Mapping) else updates
+        if collector.__class__ is _StatsCollector:
+            data = collector._data  # type: ignore[attr-defined]
+            for key, amount in items:
+                data[key][tags_tuple] += amount
+        else:
+            add = collector._add
+            for key, amount in items:
+                add(key, tags_tuple, amount)
+
+
+def gauge(key: str, value: int | float, tags: Tags | TagSet | None = None) -> None:
+    """Record the current value of key. The most recently recorded value wins,
+    in nested scopes and across recordings alike."""
+    collector = _current_collector.get() if _enabled else None
+    if collector:
+        collector._update(key, _normalize_tags(tags), value, _GAUGE)
+
+
+def record_max(
+    key: str, value: int | float, tags: Tags | TagSet | None = None
+) -> None:
+    """Record value for key, keeping only the largest value seen."""
+    collector = _current_collector.get() if _enabled else None
+    if collector:
+        collector._update(key, _normalize_tags(tags), value, _MAX)
+
+
+def record_min(
+    key: str, value: int | float, tags: Tags | TagSet | None = None
+) -> None:
+    """Record value for key, keeping only the smallest value seen."""
+    collector = _current_collector.get() if _enabled else None
+    if collector:
+        collector._update(key, _normalize_tags(tags), value, _MIN)
+
+
+def observe(key: str, value: float, tags: Tags | TagSet | None = None) -> None:
+    """Add value to the quantile sketch of key, e.g. a payload size or row count.
+
+    get_result reports {key}.p50, {key}.p90 and {key}.p99, each within 1% of
+    the true value; Recorder.get_quantile answers any other quantile.
+    Infinite and NaN values raise ValueError.
+    """
+    collector = _current_collector.get() if _enabled else None
+    if collector:
+        collector._object(key, _normalize_tags(tags), _SKETCH, _Sketch).add(value)
+
+
+def summary(key: str, value: float, tags: Tags | TagSet | None = None) -> None:
+    """Add value to the summary of key.
+
+    get_result reports {key}.count, .sum, .mean, .min, .max and .stddev
+    (population standard deviation).
+    """
+    collector = _current_collector.get() if _enabled else None
+    if collector:
+        collector._object(key, _normalize_tags(tags), _SUMMARY, _Summary).add(value)
+
+
+class Counter:
+    """Counter bound to a key and tags up front. Create with counter().
+
+    The key and normalized tags are resolved once, and the slot in the active
+    collector is cached between calls, so incr() skips tag normalization and
+    the per-key dict lookup that the module-level incr() pays.
+    """
+
+    __slots__ = ("key", "tags", "_cache")
+
+    def __init__(self, key: str, tags: Tags | TagSet | None = None) -> None:
+        self.key = key
+        self.tags = _normalize_tags(tags)
+        # (collector, mapping, subkey) for the collector this counter last
+        # wrote to; see _Collector._slot
+        self._cache: tuple[_Collector | None, _SlotStorage, Any] = (None, {}, None)
+
+    def __repr__(self) -> str:
+        return f"Counter({self.key!r}, tags={dict(self.tags)!r})"
+
+    def incr(self, amount: int | float = 1) -> None:
+        collector = _current_collector.get() if _enabled else None
+        if collector:
+            cache = self._cache
+            # A collector whose storage went back to the pool is no longer
+            # _allocated; re-resolving gives it fresh storage nobody reads
+            if cache[0] is not collector or not collector._allocated:
+                cache = self._cache = (collector, *collector._slot(self.key, self.tags))
+            cache[1][cache[2]] += amount
+
+
+class Timer:
+    """Timer bound to a key and tags up front.
+
+    record() adds one call and its duration to ``{key}.count`` and
+    ``{key}.total_dur``, with the same slot caching as Counter. The timer
+    decorator uses one of these per decorated function.
+
+    With histogram=True, durations are also added to a histogram under
+    ``{key}``, reported as ``{key}.p50``, ``{key}.p90`` and ``{key}.p99``.
+    """
+
+    __slots__ = ("key", "tags", "histogram", "_count_key", "_dur_key", "_cache")
+
+    def __init__(
+        self, key: str, tags: Tags | TagSet | None = None, histogram: bool = False
+    ) -> None:
+        self.key = key
+        self.tags = _normalize_tags(tags)
+        self.histogram = histogram
+        self._count_key = f"{key}.count"
+        self._dur_key = f"{key}.total_dur"
+        # (collector, count mapping, count subkey, duration mapping, duration
+        # subkey, histogram or None, span buffer or None) for the last
+        # collector used
+        self._cache: tuple[
+            _Collector | None,
+            _SlotStorage,
+            Any,
+            _SlotStorage,
+            Any,
+            _Histogram | None,
+            _SpanBuffer | None,
+        ] = (None, {}, None, {}, None, None, None)
+
+    def __repr__(self) -> str:
+        return f"Timer({self.key!r}, tags={dict(self.tags)!r})"
+
+    def record(self, duration_secs: float) -> None:
+        collector = _current_collector.get() if _enabled else None
+        if collector:
+            self._record(collector, duration_secs)
+
+    def _record(
+        self,
+        collector: _Collector,
+        duration_secs: float,
+        start: float | None = None,
+    ) -> None:
+        """Record one call; start is its perf_counter() start time, for spans."""
+        cache = self._cache
+        if cache[0] is not collector or not collector._allocated:
+            cache = self._fill_cache(collector)
+        cache[1][cache[2]] += 1
+        cache[3][cache[4]] += duration_secs
+        if cache[5] is not None:
+            cache[5].add(duration_secs)
+        if cache[6] is not None:
+            cache[6].add(self.key, self.tags, duration_secs, start)
+
+    def _record_call(self, collector: _Collector) -> None:
+        """Count a call without adding a duration."""
+        cache = self._cache
+        if cache[0] is not collector or not collector._allocated:
+            cache = self._fill_cache(collector)
+        cache[1][cache[2]] += 1
+
+    def _fill_cache(self, collector: _Collector) -> tuple[Any, ...]:
+        tags_tuple = self.tags
+        cache = self._cache = (
+            collector,
+            *collector._slot(self._count_key, tags_tuple),
+            *collector._slot(self._dur_key, tags_tuple),
+            collector._object(self.key, tags_tuple, _HISTOGRAM, _Histogram)
+            if self.histogram
+            else None,
+            collector._spans,
+        )
+        return cache
+
+
+class Timed:
+    """Context manager timing its block into a Timer's keys. Create with timed().
+
+    A plain slotted class rather than a @contextmanager generator, so entering
+    and exiting cost two method calls. The same object can be used for any
+    number of blocks, one at a time: keep one per thread, and do not nest it
+    inside itself.
+    """
+
+    __slots__ = ("timer", "_collector", "_start")
+
+    def __init__(
+        self, key: str, tags: Tags | TagSet | None = None, histogram: bool = False
+    ) -> None:
+        self.timer = Timer(key, tags, histogram=histogram)
+
+    def __repr__(self) -> str:
+        return f"Timed({self.timer.key!r}, tags={dict(self.timer.tags)!r})"
+
+    def __enter__(self) -> Timed:
+        self._collector = _current_collector.get() if _enabled else None
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(
+        self,
+        exc_type: type[BaseException] | None,
+        exc: BaseException | None,
+        tb: TracebackType | None,
+    ) -> None:
+        duration = time.perf_counter() - self._start
+        collector = self._collector
+        if collector:
+            self.timer._record(collector, duration, self._start)
+
+
+def counter(key: str, tags: Tags | TagSet | None = None) -> Counter:
+    """Create a Counter handle for a key and tags that are known up front."""
+    return Counter(key, tags)
+
+
+def timed(
+    key: str, tags: Tags | TagSet | None = None, histogram: bool = False
+) -> Timed:
+    """Time a block into {key}.count and {key}.total_dur, like @timer.
+
+    with scopedstats.timed("parse"):
+        ...
+    """
+    return Timed(key, tags, histogram)
+
+
+def timer_start() -> float:
+    """Start an inline timing; pass the result to timer_stop()."""
+    return time.perf_counter()
+
+
+def timer_stop(handle: Timer, start: float) -> float:
+    """Record the time since timer_start() on a Timer handle and return it."""
+    duration = time.perf_counter() - start
+    collector = _current_collector.get() if _enabled else None
+    if collector:
+        handle._record(collector, duration, start)
+    return duration
+
+
+# timer(clock=...) -> (whether total_dur is wall time, CPU clock in ns).
+# With both, the CPU time goes to {key}.cpu_dur.
+_TIMER_CLOCKS: dict[str, tuple[bool, Callable[[], int] | None]] = {
+    "wall": (True, None),
+    "thread_cpu": (False, time.thread_time_ns),
+    "process_cpu": (False, time.process_time_ns),
+    "wall+thread_cpu": (True, time.thread_time_ns),
+    "wall+process_cpu": (True, time.process_time_ns),
+}
+
+
+class _StepTimes:
+    """Time spent inside a generator or coroutine frame, and what it yielded."""
+
+    __slots__ = ("running", "cpu", "cpu_clock", "items", "first_item", "start")
+
+    def __init__(self, cpu_clock: Callable[[], int] | None = None) -> None:
+        # perf_counter() time of the first step, for spans
+        self.start = time.perf_counter()
+        # Wall time, and CPU time by cpu_clock if one is given
+        self.running = 0.0
+        self.cpu = 0.0
+        self.cpu_clock = cpu_clock
+        self.items = 0
+        # Wall time spent inside the frame until the first item was yielded
+        self.first_item: float | None = None
+
+
+def _timed_generator(
+    steps: Generator[Any, Any, T], times: _StepTimes
+) -> Generator[Any, Any, T]:
+    """Run steps, forwarding send/throw/close, and add the time spent inside
+    each step to times. Time spent outside (suspended) is not counted."""
+    send_value: Any = None
+    error: BaseException | None = None
+    cpu_clock = times.cpu_clock
+    while True:
+        if cpu_clock is not None:
+            cpu_start = cpu_clock()
+        step_start = time.perf_counter()
+        try:
+            if error is None:
+                item = steps.send(send_value)
+            else:
+                item = steps.throw(error)
+        except StopIteration as stop:
+            return stop.value  # type: ignore[no-any-return]
+        finally:
+            times.running += time.perf_counter() - step_start
+            if cpu_clock is not None:
+                times.cpu += (cpu_clock() - cpu_start) * 1e-9
+        times.items += 1
+        if times.first_item is None:
+            times.first_item = times.running
+        try:
+            send_value = yield item
+            error = None
+        except GeneratorExit:
+            steps.close()
+            raise
+        except BaseException as exc:
+            error = exc
+
+
+@types.coroutine
+def _timed_steps(
+    coro: Coroutine[Any, Any, T], times: _StepTimes
+) -> Generator[Any, Any, T]:
+    """Await coro, timing only the steps it spends running (see _timed_generator)."""
+    return (yield from _timed_generator(coro.__await__(), times))
+
+
+class _TimerFrame:
+    """An active call of a self_time timer; see _current_frame."""
+
+    __slots__ = ("key", "parent", "child_time")
+
+    def __init__(self, key: str, parent: _TimerFrame | None) -> None:
+        self.key = key
+        self.parent = parent
+        # Total duration of the self_time calls made directly from this one
+        self.child_time = 0.0
+
+
+# Innermost active self_time call. A ContextVar rather than a stack on the
+# collector, so threads and tasks recording into the same scope each see
+# their own call chain.
+_current_frame: ContextVar[_TimerFrame | None] = ContextVar(
+    "current_timer_frame", default=None
+)
+
+# (parent key, child key) -> (edge count key, edge duration key)
+_edge_keys: dict[tuple[str, str], tuple[str, str]] = {}
+
+
+def _record_frame(
+    handle: Timer,
+    collector: _Collector,
+    frame: _TimerFrame,
+    self_key: str,
+    duration: float,
+) -> None:
+    """Record a finished self_time call's self time and its call-tree edge."""
+    tags_tuple = handle.tags
+    collector._add(self_key, tags_tuple, duration - frame.child_time)
+    parent = frame.parent
+    if parent is not None:
+        parent.child_time += duration
+        edge = (parent.key, frame.key)
+        keys = _edge_keys.get(edge)
+        if keys is None:
+            prefix = f"{parent.key} -> {frame.key}"
+            keys = _edge_keys[edge] = (f"{prefix}.count", f"{prefix}.total_dur")
+        collector._add(keys[0], tags_tuple, 1)
+        collector._add(keys[1], tags_tuple, duration)
+
+
+def _record_clocked(
+    handle: Timer,
+    collector: _Collector,
+    wall: bool,
+    wall_dur: float,
+    cpu_dur: float | None,
+    start: float | None = None,
+) -> None:
+    """Record one call with the durations the timer's clock mode asks for."""
+    if not wall:
+        handle._record(collector, cpu_dur, start)  # type: ignore[arg-type]
+        return
+    handle._record(collector, wall_dur, start)
+    if cpu_dur is not None:
+        collector._add(f"{handle.key}.cpu_dur", handle.tags, cpu_dur)
+
+
+def _record_generator(
+    handle: Timer, collector: _Collector, times: _StepTimes, wall: bool
+) -> None:
+    cpu_dur = times.cpu if times.cpu_clock is not None else None
+    _record_clocked(handle, collector, wall, times.running, cpu_dur, times.start)
+    key, tags_tuple = handle.key, handle.tags
+    collector._add(f"{key}.items", tags_tuple, times.items)
+    if times.first_item is not None:
+        collector._add(f"{key}.first_item_dur", tags_tuple, times.first_item)
+
+
+def _outermost_only(
+    f: Callable[P, T], wrapper: Callable[P, T], handle: Timer
+) -> Callable[P, T]:
+    """Wrap a timer wrapper so only the outermost active call is timed.
+
+    Re-entrant calls into the same collector are counted and run f directly.
+    The collector of the outermost active call lives in a ContextVar, so each
+    thread and task tracks its own activations, and a call in a nested
+    record() scope is outermost for that scope's collector.
+    """
+    active: ContextVar[_Collector | None] = ContextVar(
+        f"active_{handle.key}", default=None
+    )
+
+    if inspect.iscoroutinefunction(f):
+        coro_func: Callable[P, Coroutine[Any, Any, Any]] = f
+        coro_wrapper: Callable[P, Coroutine[Any, Any, Any]]
+        coro_wrapper = wrapper  # type: ignore[assignment]
+
+        @functools.wraps(f)
+        async def async_wrapper(*args: P.args, **kwargs: P.kwargs) -> Any:
+            collector = _current_collector.get() if _enabled else None
+            if not collector:
+                return await coro_func(*args, **kwargs)
+            if active.get() is collector:
+                handle._record_call(collector)
+                return await coro_func(*args, **kwargs)
+            token = active.set(collector)
+            try:
+                return await coro_wrapper(*args, **kwargs)
+            finally:
+                active.reset(token)
+
+        return async_wrapper  # type: ignore[return-value]
+
+    @functools.wraps(f)
+    def outermost_wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
+        collector = _current_collector.get() if _enabled else None
+        if not collector:
+            return f(*args, **kwargs)
+        if active.get() is collector:
+            handle._record_call(collector)
+            return f(*args, **kwargs)
+        token = active.set(collector)
+        try:
+            return wrapper(*args, **kwargs)
+        finally:
+            active.reset(token)
+
+    return outermost_wrapper
 
 
 def timer(
     func: Callable[P, T] | None = None,
     *,
     key: str | None = None,
-    tags: Tags | None = None,
+    tags: Tags | TagSet | None = None,
+    histogram: bool = False,
+    running_time: bool = False,
+    clock: str = "wall",
+    self_time: bool = False,
+    outermost_only: bool = False,
 ) -> Callable[P, T] | Callable[[Callable[P, T]], Callable[P, T]]:
     """Decorator to time function execution and record statistics.
 
@@ -176,16 +2358,259 @@ def timer(
     - {key}.count: Number of calls
     - {key}.total_dur: Total duration in seconds
 
+    With histogram=True, also records a duration histogram reported as
+    {key}.p50, {key}.p90 and {key}.p99.
+
+    Coroutine functions are timed from the start of the awaited call until
+    it completes, and only calls that are actually awaited are counted. The
+    collector is taken from the awaiting task's context when the call starts.
+    With running_time=True they also record {key}.running_dur, the part of
+    that time spent running on the event loop rather than suspended.
+
+    Generator and async generator functions are timed across every step of
+    the returned generator: total_dur is the time spent inside its frame,
+    {key}.items counts the items yielded and {key}.first_item_dur adds up
+    the time until each call's first item. A call is counted once iteration
+    starts.
+
+    clock selects what total_dur measures: "wall" (default, perf_counter),
+    "thread_cpu" or "process_cpu" (CPU time of the calling thread or the
+    whole process). "wall+thread_cpu" and "wall+process_cpu" keep wall time
+    in total_dur and add the CPU time as {key}.cpu_dur. For coroutines and
+    generators, CPU time is only taken while their frame is running.
+
+    self_time=True (wall clock only; functions and coroutines) tracks calls
+    between self_time timers. Each one also records {key}.self_dur, its
+    duration minus that of the self_time calls it made, and each call made
+    from another self_time timer records "{parent} -> {key}.count" and
+    ".total_dur" edges.
+
+    outermost_only=True (functions and coroutines) still counts every call
+    of a recursive function, but only adds the outermost active call's
+    duration, so total_dur does not count nested activations twice.
+
     Default key is "calls.{func.__qualname__}".
     """
+    try:
+        wall, cpu_clock = _TIMER_CLOCKS[clock]
+    except KeyError:
+        raise ValueError(
+            f"Unknown timer clock {clock!r}, expected one of {sorted(_TIMER_CLOCKS)}"
+        ) from None
+    if self_time and clock != "wall":
+        raise ValueError("self_time requires the wall clock")
 
     def create_wrapper(f: Callable[P, T]) -> Callable[P, T]:
         timer_key = key if key is not None else f"calls.{f.__qualname__}"
-        tags_tuple = () if not tags else _normalize_tags(tags)
+        handle = Timer(timer_key, tags, histogram=histogram)
+        wrapper = create_timed_wrapper(f, handle)
+        if outermost_only:
+            if inspect.isgeneratorfunction(f) or inspect.isasyncgenfunction(f):
+                raise ValueError(
+                    "outermost_only is not supported for generator functions"
+                )
+            return _outermost_only(f, wrapper, handle)
+        return wrapper
+
+    def create_timed_wrapper(f: Callable[P, T], handle: Timer) -> Callable[P, T]:
+        timer_key = handle.key
+        self_key = f"{timer_key}.self_dur"
+
+        if inspect.iscoroutinefunction(f):
+            coro_func: Callable[P, Coroutine[Any, Any, Any]] = f
+            running_key = f"{timer_key}.running_dur"
+
+            @functools.wraps(f)
+            async def async_wrapper(*args: P.args, **kwargs: P.kwargs) -> Any:
+                collector = _current_collector.get() if _enabled else None
+                if not collector:
+                    return await coro_func(*args, **kwargs)
+
+                times = (
+                    _StepTimes(cpu_clock)
+                    if running_time or cpu_clock is not None
+                    else None
+                )
+                if self_time:
+                    frame = _TimerFrame(timer_key, _current_frame.get())
+                    token = _current_frame.set(frame)
+                start_time = time.perf_counter()
+                try:
+                    if times is None:
+                        return await coro_func(*args, **kwargs)
+                    return await _timed_steps(coro_func(*args, **kwargs), times)
+                finally:
+                    end_time = time.perf_counter()
+                    if self_time:
+                        _current_frame.reset(token)
+                        _record_frame(
+                            handle, collector, frame, self_key, end_time - start_time
+                        )
+                    if times is None:
+                        handle._record(collector, end_time - start_time, start_time)
+                    else:
+                        cpu_dur = times.cpu if cpu_clock is not None else None
+                        _record_clocked(
+                            handle,
+                            collector,
+                            wall,
+                            end_time - start_time,
+                            cpu_dur,
+                            start_time,
+                        )
+                        if running_time:
+                            collector._add(running_key, handle.tags, times.running)
+
+            return async_wrapper  # type: ignore[return-value]
+
+        if self_time and (
+            inspect.isgeneratorfunction(f) or inspect.isasyncgenfunction(f)
+        ):
+            raise ValueError("self_time is not supported for generator functions")
+
+        if inspect.isgeneratorfunction(f):
+            gen_func: Callable[P, Generator[Any, Any, Any]]
+            gen_func = f  # type: ignore[assignment]
+
+            @functools.wraps(f)
+            def gen_wrapper(*args: P.args, **kwargs: P.kwargs) -> Any:
+                collector = _current_collector.get() if _enabled else None
+                if not collector:
+                    return (yield from gen_func(*args, **kwargs))
+
+                times = _StepTimes(cpu_clock)
+                try:
+                    steps = gen_func(*args, **kwargs)
+                    return (yield from _timed_generator(steps, times))
+                finally:
+                    _record_generator(handle, collector, times, wall)
+
+            return gen_wrapper  # type: ignore[return-value]
+
+        if inspect.isasyncgenfunction(f):
+            agen_func: Callable[P, AsyncGenerator[Any, Any]]
+            agen_func = f  # type: ignore[assignment]
+
+            @functools.wraps(f)
+            async def agen_wrapper(*args: P.args, **kwargs: P.kwargs) -> Any:
+                # Async generators cannot delegate with yield from, so this
+                # forwards asend/athrow/aclose itself
+                collector = _current_collector.get() if _enabled else None
+                agen = agen_func(*args, **kwargs)
+                send_value: Any = None
+                error: BaseException | None = None
+                if not collector:
+                    while True:
+                        try:
+                            if error is None:
+                                item = await agen.asend(send_value)
+                            else:
+                                item = await agen.athrow(error)
+                        except StopAsyncIteration:
+                            return
+                        try:
+                            send_value = yield item
+                            error = None
+                        except GeneratorExit:
+                            await agen.aclose()
+                            raise
+                        except BaseException as exc:
+                            error = exc
+
+                times = _StepTimes(cpu_clock)
+                # With a CPU clock, each step is awaited through _timed_steps,
+                # which only reads the clock while the generator is running,
+                # not while it is suspended in an await
+                cpu_steps = _StepTimes(cpu_clock) if cpu_clock is not None else None
+                try:
+                    while True:
+                        if error is None:
+                            step = agen.asend(send_value)
+                        else:
+                            step = agen.athrow(error)
+                        step_start = time.perf_counter()
+                        try:
+                            if cpu_steps is None:
+                                item = await step
+                            else:
+                                item = await _timed_steps(
+                                    step, cpu_steps  # type: ignore[arg-type]
+                                )
+                        except StopAsyncIteration:
+                            return
+                        finally:
+                            times.running += time.perf_counter() - step_start
+                        times.items += 1
+                        if times.first_item is None:
+                            times.first_item = times.running
+                        try:
+                            send_value = yield item
+                            error = None
+                        except GeneratorExit:
+                            await agen.aclose()
+                            raise
+                        except BaseException as exc:
+                            error = exc
+                finally:
+                    if cpu_steps is not None:
+                        times.cpu = cpu_steps.cpu
+                    _record_generator(handle, collector, times, wall)
+
+            return agen_wrapper  # type: ignore[return-value]
+
+        if cpu_clock is not None:
+            read_cpu = cpu_clock
+
+            @functools.wraps(f)
+            def cpu_wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
+                collector = _current_collector.get() if _enabled else None
+                if not collector:
+                    return f(*args, **kwargs)
+
+                start_time = time.perf_counter()
+                cpu_start = read_cpu()
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    cpu_dur = (read_cpu() - cpu_start) * 1e-9
+                    end_time = time.perf_counter()
+                    _record_clocked(
+                        handle,
+                        collector,
+                        wall,
+                        end_time - start_time,
+                        cpu_dur,
+                        start_time,
+                    )
+
+            return cpu_wrapper
+
+        if self_time:
+
+            @functools.wraps(f)
+            def tree_wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
+                collector = _current_collector.get() if _enabled else None
+                if not collector:
+                    return f(*args, **kwargs)
+
+                frame = _TimerFrame(timer_key, _current_frame.get())
+                token = _current_frame.set(frame)
+                start_time = time.perf_counter()
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    end_time = time.perf_counter()
+                    _current_frame.reset(token)
+                    handle._record(collector, end_time - start_time, start_time)
+                    _record_frame(
+                        handle, collector, frame, self_key, end_time - start_time
+                    )
+
+            return tree_wrapper
 
         @functools.wraps(f)
         def wrapper(*args: P.args, **kwargs: P.kwargs) -> T:
-            collector = _current_collector.get()
+            collector = _current_collector.get() if _enabled else None
             if not collector:
                 return f(*args, **kwargs)
 
@@ -194,10 +2619,7 @@ def timer(
                 return f(*args, **kwargs)
             finally:
                 end_time = time.perf_counter()
-                duration_secs = end_time - start_time
-
-                collector._data[f"{timer_key}.count"][tags_tuple] += 1
-                collector._data[f"{timer_key}.total_dur"][tags_tuple] += duration_secs
+                handle._record(collector, end_time - start_time, start_time)
 
         return wrapper
 
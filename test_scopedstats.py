@@ -1,3 +1,4 @@
+import math
 import pytest
 import time
 from scopedstats import Recorder, incr, timer
@@ -73,6 +74,35 @@ def test_nested_contexts():
     assert "total_recording_duration" in result2
 
 
+def test_record_as_decorator():
+    """@recorder.record() opens a fresh scope for every call."""
+    import asyncio
+
+    stats = Recorder()
+
+    @stats.record()
+    def handle(n):
+        incr("requests")
+        if n:
+            handle(n - 1)
+        return n
+
+    @stats.record(keep_if=lambda duration, collector: collector.get("slow") > 0)
+    async def fetch(slow):
+        await asyncio.sleep(0)
+        incr("slow", amount=int(slow))
+        incr("fetches")
+
+    assert handle(2) == 2
+    assert handle.__name__ == "handle"
+    asyncio.run(fetch(False))
+    asyncio.run(fetch(True))
+
+    result = stats.get_stats()
+    # Nested calls are also counted by their enclosing call's scope
+    assert result["requests"] == 3 + 2 + 1
+    assert result["fetches"] == 1
+
 def test_no_active_context():
     incr("key1", amount=100)
 
@@ -489,5 +519,1744 @@ def test_backward_compatibility_statsdata():
     assert "total_recording_duration" in result
 
 
+def test_tag_cache_is_bounded():
+    import scopedstats
+
+    scopedstats.clear_tag_cache()
+    scopedstats.set_tag_cache_size(8)
+    try:
+        recorder = Recorder()
+        with recorder.record():
+            for i in range(100):
+                incr("batches", tags={"batch": str(i)})
+
+        info = scopedstats.tag_cache_info()
+        assert info.maxsize == 8
+        assert info.currsize <= 8
+        assert info.misses == 100
+        assert info.evictions >= 92
+        assert info.evictions + info.currsize == info.misses
+
+        # Evicted tag sets still normalize and filter correctly
+        assert recorder.get_result(tag_filter={"batch": "0"}) == {"batches": 1}
+    finally:
+        scopedstats.set_tag_cache_size(4096)
+        scopedstats.clear_tag_cache()
+
+
+def test_tag_cache_hits_within_working_set():
+    import scopedstats
+
+    scopedstats.clear_tag_cache()
+    scopedstats.set_tag_cache_size(4)
+    try:
+        recorder = Recorder()
+        with recorder.record():
+            for _ in range(50):
+                incr("calls", tags={"endpoint": "/a"})
+                incr("calls", tags={"endpoint": "/b"})
+
+        info = scopedstats.tag_cache_info()
+        assert info.misses == 2
+        assert info.hits == 98
+        assert info.evictions == 0
+        assert recorder.get_result()["calls"] == 100
+    finally:
+        scopedstats.set_tag_cache_size(4096)
+        scopedstats.clear_tag_cache()
+
+
+def test_tag_cache_holds_a_working_set_close_to_maxsize():
+    """A working set just under maxsize stays cached instead of thrashing."""
+    import scopedstats
+
+    scopedstats.clear_tag_cache()
+    scopedstats.set_tag_cache_size(1000)
+    try:
+        tag_sets = [{"shard": str(i)} for i in range(900)]
+        recorder = Recorder()
+        with recorder.record():
+            for tags in tag_sets:
+                incr("queries", tags=tags)
+            first = scopedstats.tag_cache_info()
+            for _ in range(3):
+                for tags in tag_sets:
+                    incr("queries", tags=tags)
+
+        info = scopedstats.tag_cache_info()
+        assert first.misses == 900
+        assert info.misses == 900
+        assert info.hits - first.hits == 3 * 900
+        assert info.evictions == 0
+        assert info.currsize == 900
+
+        # Past maxsize, entries are evicted one at a time
+        with recorder.record():
+            for i in range(900, 1200):
+                incr("queries", tags={"shard": str(i)})
+        info = scopedstats.tag_cache_info()
+        assert info.currsize == 1000
+        assert info.evictions == 200
+    finally:
+        scopedstats.set_tag_cache_size(4096)
+        scopedstats.clear_tag_cache()
+
+def test_tag_cache_size_zero_disables_caching():
+    import scopedstats
+
+    scopedstats.clear_tag_cache()
+    scopedstats.set_tag_cache_size(0)
+    try:
+        recorder = Recorder()
+        with recorder.record():
+            incr("calls", tags={"endpoint": "/a"})
+            incr("calls", tags={"endpoint": "/a"})
+
+        assert scopedstats.tag_cache_info().currsize == 0
+        assert recorder.get_result(tag_filter={"endpoint": "/a"}) == {"calls": 2}
+
+        with pytest.raises(ValueError):
+            scopedstats.set_tag_cache_size(-1)
+    finally:
+        scopedstats.set_tag_cache_size(4096)
+        scopedstats.clear_tag_cache()
+
+
+def test_tagset_handles():
+    import scopedstats
+
+    handle = scopedstats.tagset({"status": "success", "region": "us"})
+    assert handle == scopedstats.tagset({"region": "us", "status": "success"})
+    assert hash(handle) == hash(scopedstats.tagset({"status": "success", "region": "us"}))
+    assert scopedstats.tagset(handle) is handle
+    assert scopedstats.tagset() == ()
+
+    recorder = Recorder()
+    with recorder.record():
+        incr("requests", tags=handle)
+        incr("requests", tags={"status": "success", "region": "us"}, amount=2)
+        incr("requests", tags=scopedstats.tagset({"status": "error"}))
+
+    assert recorder.get_result()["requests"] == 4
+    assert recorder.get_result(tag_filter={"status": "success"}) == {"requests": 3}
+    assert recorder.get_result(tag_filter={"region": "us"}) == {"requests": 3}
+
+
+def test_tagset_with_timer():
+    import scopedstats
+
+    recorder = Recorder()
+    tags = scopedstats.tagset({"service": "user"})
+
+    @timer(key="tagged_call", tags=tags)
+    def tagged_call():
+        return 1
+
+    with recorder.record():
+        tagged_call()
+
+    service_stats = recorder.get_result(tag_filter={"service": "user"})
+    assert service_stats["tagged_call.count"] == 1
+
+
+def test_counter_handle():
+    import scopedstats
+
+    rows = scopedstats.counter("db.rows", tags={"table": "users"})
+    untagged = scopedstats.counter("db.queries")
+
+    rows.incr(5)  # No active recorder: ignored
+
+    stats_outer = Recorder()
+    stats_inner = Recorder()
+    with stats_outer.record():
+        rows.incr(10)
+        untagged.incr()
+        with stats_inner.record():
+            rows.incr(3)
+            incr("db.rows", tags={"table": "users"}, amount=2)
+        rows.incr()
+
+    assert stats_inner.get_result()["db.rows"] == 5
+    outer = stats_outer.get_result()
+    assert outer["db.rows"] == 16
+    assert outer["db.queries"] == 1
+    assert stats_outer.get_result(tag_filter={"table": "users"}) == {"db.rows": 16}
+
+    # A new recording gets a fresh slot rather than the cached one
+    with stats_inner.record():
+        rows.incr(4)
+    assert stats_inner.get_result()["db.rows"] == 9
+
+
+def test_timer_handle():
+    import scopedstats
+
+    handle = scopedstats.Timer("manual", tags={"kind": "batch"})
+    recorder = Recorder()
+    with recorder.record():
+        handle.record(0.5)
+        handle.record(0.25)
+
+    result = recorder.get_result(tag_filter={"kind": "batch"})
+    assert result == {"manual.count": 2, "manual.total_dur": 0.75}
+
+
+def test_indexed_tag_filter_matches_full_scan():
+    import random
+
+    from scopedstats import _get_filtered_stats
+
+    rng = random.Random(1234)
+    recorder = Recorder()
+    for _ in range(3):
+        with recorder.record():
+            for _ in range(2000):
+                tags = {
+                    "endpoint": rng.choice(["/a", "/b", "/c", "/d"]),
+                    "shard": str(rng.randrange(50)),
+                }
+                if rng.random() < 0.3:
+                    tags["cached"] = rng.random() < 0.5
+                incr(rng.choice(["hits", "misses", "bytes"]), tags=tags)
+                incr("latency", tags=tags, amount=rng.random())
+
+    filters = [
+        {"endpoint": "/a"},
+        {"endpoint": "/b", "shard": "7"},
+        {"cached": True},
+        {"cached": False, "endpoint": "/d"},
+        {"shard": "does-not-exist"},
+        {"endpoint": "/a", "other": "x"},
+    ]
+    for tag_filter in filters:
+        result = recorder.get_result(tag_filter=tag_filter)
+        expected = _get_filtered_stats(recorder._store._items(), tag_filter)
+        assert result == expected
+        assert list(result) == list(expected)
+
+
+def test_group_by_breakdown():
+    recorder = Recorder()
+
+    with recorder.record():
+        incr("api.calls", tags={"endpoint": "/users", "method": "GET"}, amount=3)
+        incr("api.calls", tags={"endpoint": "/users", "method": "POST"})
+        incr("api.calls", tags={"endpoint": "/posts", "method": "GET"}, amount=2)
+        incr("api.calls", tags={"endpoint": "/posts", "method": "GET", "cached": True})
+        incr("api.calls", tags={"endpoint": "/health"})
+        incr("api.errors", tags={"endpoint": "/users", "method": "POST"})
+
+    result = recorder.get_result(group_by=["endpoint", "method"])
+    assert result["api.calls"] == {
+        ("/users", "GET"): 3,
+        ("/users", "POST"): 1,
+        ("/posts", "GET"): 3,
+        ("/health", None): 1,
+    }
+    assert result["api.errors"] == {("/users", "POST"): 1}
+    assert result["total_recording_duration"].keys() == {(None, None)}
+
+    # A single tag name works as well
+    by_method = recorder.get_result(group_by="method")
+    assert by_method["api.calls"] == {("GET",): 6, ("POST",): 1, (None,): 1}
+
+
+def test_group_by_with_tag_filter():
+    recorder = Recorder()
+
+    with recorder.record():
+        incr("api.calls", tags={"endpoint": "/users", "method": "GET"}, amount=3)
+        incr("api.calls", tags={"endpoint": "/users", "method": "POST"})
+        incr("api.calls", tags={"endpoint": "/posts", "method": "GET"}, amount=2)
+
+    result = recorder.get_result(tag_filter={"method": "GET"}, group_by=["endpoint"])
+    assert result == {"api.calls": {("/users",): 3, ("/posts",): 2}}
+
+    assert recorder.get_result(tag_filter={"method": "PUT"}, group_by=["endpoint"]) == {}
+
+
+def _record_mixed_workload(outer: Recorder, inner: Recorder) -> None:
+    import scopedstats
+
+    rows = scopedstats.counter("db.rows", tags={"table": "users"})
+
+    @timer(key="work", tags={"kind": "batch"})
+    def work():
+        return None
+
+    with outer.record():
+        incr("requests", tags={"endpoint": "/a", "method": "GET"})
+        incr("requests", tags={"endpoint": "/b"}, amount=2)
+        rows.incr(3)
+        with inner.record():
+            incr("requests", tags={"endpoint": "/a", "method": "GET"}, amount=4)
+            incr("inner_only", amount=0.5)
+            rows.incr()
+            work()
+        work()
+
+
+def _without_durations(result):
+    return {
+        k: v for k, v in result.items() if not k.endswith(("_dur", "_duration"))
+    }
+
+
+@pytest.mark.parametrize("storage", ["nested", "flat", "array"])
+def test_storage_engines_give_identical_results(storage):
+    reference_outer, reference_inner = Recorder(), Recorder()
+    _record_mixed_workload(reference_outer, reference_inner)
+
+    outer, inner = Recorder(storage=storage), Recorder(storage=storage)
+    _record_mixed_workload(outer, inner)
+
+    for reference, recorder in ((reference_outer, outer), (reference_inner, inner)):
+        for tag_filter in (None, {"endpoint": "/a"}, {"kind": "batch"}):
+            expected = reference.get_result(tag_filter=tag_filter)
+            result = recorder.get_result(tag_filter=tag_filter)
+            assert list(result) == list(expected)
+            assert _without_durations(result) == _without_durations(expected)
+        assert _without_durations(
+            recorder.get_result(group_by=["endpoint"])
+        ) == _without_durations(reference.get_result(group_by=["endpoint"]))
+
+    assert outer.get_result()["requests"] == 7
+    assert outer.get_result()["db.rows"] == 4
+    assert inner.get_result()["work.count"] == 1
+
+
+def test_mixed_storage_engines_nest():
+    outer = Recorder(storage="flat")
+    inner = Recorder()
+
+    with outer.record():
+        incr("hits", tags={"cache": "redis"})
+        with inner.record():
+            incr("hits", tags={"cache": "redis"}, amount=2)
+            incr("hits", tags={"cache": "local"})
+
+    assert inner.get_result()["hits"] == 3
+    assert outer.get_result()["hits"] == 4
+    assert outer.get_result(tag_filter={"cache": "redis"}) == {"hits": 3}
+
+
+def test_array_storage_engine():
+    import scopedstats
+
+    outer = Recorder(storage="array")
+    inner = Recorder(storage="array")
+    rows = scopedstats.counter("array.rows")
+
+    with outer.record():
+        rows.incr(2)
+        with inner.record():
+            rows.incr()
+            # Registering new series grows the collector's value list; the
+            # handle's cached slot must keep pointing at the same list
+            for i in range(50):
+                incr(f"array.key.{i}", tags={"i": str(i)})
+            rows.incr()
+        incr("array.rows", amount=10)
+
+    assert inner.get_result()["array.rows"] == 2
+    assert outer.get_result()["array.rows"] == 14
+    assert outer.get_result(tag_filter={"i": "7"}) == {"array.key.7": 1}
+
+    # Merging into a different engine goes through the generic path
+    nested = Recorder()
+    with nested.record():
+        with inner.record():
+            incr("array.rows", amount=5)
+    assert nested.get_result()["array.rows"] == 5
+    assert inner.get_result()["array.rows"] == 7
+
+
+def test_unknown_storage_engine():
+    with pytest.raises(ValueError, match="Unknown storage engine"):
+        Recorder(storage="columnar")
+
+
+@pytest.mark.parametrize("storage", ["nested", "flat", "array"])
+def test_empty_scope_skips_collector_storage(storage):
+    import scopedstats
+
+    outer = Recorder(storage=storage)
+    inner = Recorder(storage=storage)
+    seen = []
+
+    with outer.record():
+        with inner.record():
+            seen.append(scopedstats._current_collector.get())
+        incr("after_inner")
+    with inner.record():
+        pass
+
+    # The empty scope's collector never allocated its storage
+    assert seen[0]._allocated is False
+    assert seen[0]._is_empty()
+
+    inner_result = inner.get_result(require_recording=True)
+    assert list(inner_result) == ["total_recording_duration"]
+    outer_result = outer.get_result()
+    assert outer_result["after_inner"] == 1
+    assert set(outer_result) == {"after_inner", "total_recording_duration"}
+
+
+def test_deeply_nested_recorders():
+    import scopedstats
+
+    depth = 8
+    recorders = [Recorder() for _ in range(depth)]
+
+    def nested(level):
+        with recorders[level].record():
+            collector = scopedstats._current_collector.get()
+            incr("events", tags={"level": str(level)})
+            incr(f"level{level}.only")
+            if level + 1 < depth:
+                nested(level + 1)
+                # Exiting a nested scope merges everything it recorded,
+                # including its own nested scopes, into this collector
+                assert collector.get("events", {"level": str(depth - 1)}) == 11
+                assert collector.get_stats()["events"] == 11 * (depth - level) - 10
+            incr("events", tags={"level": str(level)}, amount=10)
+            incr(f"level{level}.after")
+
+    nested(0)
+
+    # Keys keep the order they were first recorded in across nested scopes
+    assert list(recorders[0].get_result()) == (
+        ["events"]
+        + [f"level{level}.only" for level in range(depth)]
+        + [f"level{level}.after" for level in reversed(range(depth))]
+        + ["total_recording_duration"]
+    )
+
+    for level, recorder in enumerate(recorders):
+        result = recorder.get_result()
+        assert result["events"] == 11 * (depth - level)
+        for inner_level in range(depth):
+            assert (f"level{inner_level}.only" in result) == (inner_level >= level)
+        assert recorder.get_result(tag_filter={"level": str(depth - 1)}) == {
+            "events": 11
+        }
+
+
+def test_pending_scopes_are_merged_in_bounded_batches():
+    import scopedstats
+
+    recorder = Recorder()
+    for i in range(scopedstats._MAX_PENDING_SCOPES * 3 + 5):
+        with recorder.record():
+            incr("requests")
+        assert len(recorder._pending) < scopedstats._MAX_PENDING_SCOPES
+
+    assert recorder.get_result()["requests"] == scopedstats._MAX_PENDING_SCOPES * 3 + 5
+    assert not recorder._pending
+
+
+@pytest.mark.parametrize("storage", ["nested", "flat", "array"])
+def test_metric_kinds_merge_rules(storage):
+    from scopedstats import gauge, record_max, record_min
+
+    outer = Recorder(storage=storage)
+    inner = Recorder(storage=storage)
+
+    with outer.record():
+        gauge("queue.depth", 3)
+        record_max("payload.bytes", 100)
+        record_min("latency", 0.5)
+        incr("requests")
+        with inner.record():
+            gauge("queue.depth", 7)
+            record_max("payload.bytes", 400)
+            record_max("payload.bytes", 250)
+            record_min("latency", 0.2)
+            incr("requests")
+        # Written after the nested scope exited, so this is the last value
+        gauge("queue.depth", 5)
+        record_max("payload.bytes", 300)
+        record_min("latency", 0.4)
+
+    assert _without_durations(inner.get_result()) == {
+        "queue.depth": 7,
+        "payload.bytes": 400,
+        "latency": 0.2,
+        "requests": 1,
+    }
+    result = outer.get_result()
+    assert result["queue.depth"] == 5
+    assert result["payload.bytes"] == 400
+    assert result["latency"] == 0.2
+    assert result["requests"] == 2
+
+    # Across recordings: last gauge wins, extremes are kept
+    with outer.record():
+        gauge("queue.depth", 1)
+        record_max("payload.bytes", 10)
+        record_min("latency", 0.9)
+    result = outer.get_result()
+    assert result["queue.depth"] == 1
+    assert result["payload.bytes"] == 400
+    assert result["latency"] == 0.2
+
+
+def test_metric_kinds_across_tags():
+    from scopedstats import gauge, record_max
+
+    recorder = Recorder()
+    with recorder.record():
+        gauge("queue.depth", 4, tags={"queue": "a"})
+        gauge("queue.depth", 6, tags={"queue": "b"})
+        record_max("payload.bytes", 10, tags={"queue": "a"})
+        record_max("payload.bytes", 30, tags={"queue": "b"})
+        gauge("idle", 0, tags={"queue": "a"})
+
+    result = recorder.get_result()
+    assert result["queue.depth"] == 10
+    assert result["payload.bytes"] == 30
+    # Zero-valued gauges are kept by a tag filter, unlike unrecorded counters
+    assert recorder.get_result(tag_filter={"queue": "a"}) == {
+        "queue.depth": 4,
+        "payload.bytes": 10,
+        "idle": 0,
+    }
+    assert recorder.get_result(group_by="queue")["payload.bytes"] == {
+        ("a",): 10,
+        ("b",): 30,
+    }
+
+
+def test_metric_kind_conflict_and_recording_duration():
+    from scopedstats import gauge, record_max
+
+    recorder = Recorder()
+    with recorder.record():
+        record_max("payload.bytes", 10)
+        with pytest.raises(ValueError, match="already recorded as a max"):
+            gauge("payload.bytes", 1)
+
+    with recorder.record():
+        time.sleep(0.01)
+    with recorder.record():
+        pass
+
+    # Each recording reports its own duration instead of adding to a sum
+    assert recorder.get_result()["total_recording_duration"] < 0.01
+
+
+@pytest.mark.parametrize("storage", ["nested", "flat", "array"])
+def test_timer_histogram_quantiles(storage):
+    from scopedstats import Timer
+
+    outer = Recorder(storage=storage)
+    inner = Recorder(storage=storage)
+    handle = Timer("db.query", histogram=True)
+    durations = [0.001 * i for i in range(1, 1001)]
+
+    with outer.record():
+        for duration in durations[:500]:
+            handle.record(duration)
+        with inner.record():
+            for duration in durations[500:]:
+                handle.record(duration)
+
+    result = outer.get_result()
+    assert result["db.query.count"] == 1000
+    for name, q in (("p50", 0.5), ("p90", 0.9), ("p99", 0.99)):
+        exact = durations[int(q * len(durations)) - 1]
+        assert result[f"db.query.{name}"] == pytest.approx(exact, rel=0.04)
+        assert outer.get_quantile("db.query", q) == result[f"db.query.{name}"]
+    assert inner.get_quantile("db.query", 0.0) == pytest.approx(0.501, rel=0.04)
+
+    # Buckets merge exactly: the outer histogram is the sum of both halves
+    # and the inner recorder's copy is untouched by merges into the outer one
+    with outer.record():
+        handle.record(0.5)
+    outer.get_result()
+    histogram = outer._store._get("db.query", ())
+    assert sum(histogram.counts) == 1001
+    assert sum(inner._store._get("db.query", ()).counts) == 500
+
+
+def test_timer_histogram_with_tags():
+    from scopedstats import Timer
+
+    recorder = Recorder()
+
+    @timer(key="handler", tags={"route": "fast"}, histogram=True)
+    def fast():
+        pass
+
+    slow = Timer("handler", tags={"route": "slow"}, histogram=True)
+    with recorder.record():
+        fast()
+        for _ in range(9):
+            slow.record(2.0)
+
+    assert recorder.get_quantile("handler", 0.5, tag_filter={"route": "slow"}) == (
+        pytest.approx(2.0, rel=0.04)
+    )
+    assert recorder.get_quantile("handler", 0.05) < 0.1
+    assert recorder.get_quantile("missing", 0.5) is None
+    with pytest.raises(ValueError):
+        recorder.get_quantile("total_recording_duration", 0.5)
+    assert recorder.get_result(group_by="route")["handler.p99"][("slow",)] == (
+        pytest.approx(2.0, rel=0.04)
+    )
+
+
+@pytest.mark.parametrize("storage", ["nested", "flat", "array"])
+def test_observe_sketch_quantiles(storage):
+    import random
+    from scopedstats import observe
+
+    rng = random.Random(7)
+    values = [rng.lognormvariate(8, 2) for _ in range(5000)]
+    values += [0.0] * 50 + [-v for v in values[:100]]
+
+    outer = Recorder(storage=storage)
+    inner = Recorder(storage=storage)
+    with outer.record():
+        for value in values[:2000]:
+            observe("payload.bytes", value, tags={"api": "v1"})
+        with inner.record():
+            for value in values[2000:]:
+                observe("payload.bytes", value, tags={"api": "v2"})
+
+    ordered = sorted(values)
+    result = outer.get_result()
+    for q in (0.0, 0.01, 0.02, 0.5, 0.9, 0.99, 1.0):
+        exact = ordered[int(q * (len(ordered) - 1))]
+        assert outer.get_quantile("payload.bytes", q) == pytest.approx(exact, rel=0.01)
+    assert result["payload.bytes.p99"] == outer.get_quantile("payload.bytes", 0.99)
+
+    # Merging is exact: the nested scope's sketch is a part of the outer one
+    v2 = sorted(values[2000:])
+    assert inner.get_quantile("payload.bytes", 0.5) == pytest.approx(
+        v2[len(v2) // 2], rel=0.01
+    )
+    assert outer.get_quantile(
+        "payload.bytes", 0.5, tag_filter={"api": "v2"}
+    ) == inner.get_quantile("payload.bytes", 0.5)
+
+
+def test_observe_sketch_memory_is_bounded():
+    import scopedstats
+    from scopedstats import observe
+
+    recorder = Recorder()
+    with recorder.record():
+        for exponent in range(-300, 300):
+            for step in range(10):
+                observe("spread", (1 + step / 10) * 10.0**exponent)
+    recorder.get_result()
+
+    sketch = recorder._store._get("spread", ())
+    assert len(sketch.positive) <= scopedstats._SKETCH_MAX_BINS
+    assert sketch.count == 6000
+    # Collapsing only touches the smallest values
+    assert recorder.get_quantile("spread", 0.99) == pytest.approx(1.9e293, rel=0.01)
+
+
+@pytest.mark.parametrize("value", [math.inf, -math.inf, math.nan])
+def test_observe_rejects_non_finite_values(value):
+    from scopedstats import observe
+
+    recorder = Recorder()
+    with recorder.record():
+        observe("size", 1.0)
+        with pytest.raises(ValueError, match="non-finite"):
+            observe("size", value)
+    assert recorder.get_result()["size.p50"] == pytest.approx(1.0, rel=0.01)
+
+
+@pytest.mark.parametrize("storage", ["nested", "flat", "array"])
+def test_summary_metric(storage):
+    import statistics
+    from scopedstats import summary
+
+    outer = Recorder(storage=storage)
+    inner = Recorder(storage=storage)
+    with outer.record():
+        for rows in (12, 40, 7):
+            summary("db.rows", rows, tags={"table": "users"})
+        with inner.record():
+            # Smallest and largest values are only seen in the nested scope
+            for rows in (3, 95, 20):
+                summary("db.rows", rows, tags={"table": "orders"})
+        summary("db.rows", 30, tags={"table": "users"})
+
+    values = [12, 40, 7, 3, 95, 20, 30]
+    result = outer.get_result()
+    assert result["db.rows.count"] == 7
+    assert result["db.rows.sum"] == 207
+    assert result["db.rows.mean"] == pytest.approx(statistics.mean(values))
+    assert result["db.rows.min"] == 3
+    assert result["db.rows.max"] == 95
+    assert result["db.rows.stddev"] == pytest.approx(statistics.pstdev(values))
+
+    assert _without_durations(inner.get_result()) == {
+        "db.rows.count": 3,
+        "db.rows.sum": 118,
+        "db.rows.mean": pytest.approx(118 / 3),
+        "db.rows.min": 3,
+        "db.rows.max": 95,
+        "db.rows.stddev": pytest.approx(statistics.pstdev([3, 95, 20])),
+    }
+    assert outer.get_result(tag_filter={"table": "users"})["db.rows.max"] == 40
+    assert outer.get_result(group_by="table")["db.rows.min"] == {
+        ("users",): 7,
+        ("orders",): 3,
+    }
+
+
+def test_summary_stddev_is_stable_for_large_values():
+    import statistics
+    from scopedstats import summary
+
+    values = [1.7e9 + i for i in range(100)]
+    recorder = Recorder()
+    for start in range(0, 100, 10):
+        with recorder.record():
+            for value in values[start : start + 10]:
+                summary("event.timestamp", value)
+
+    result = recorder.get_result()
+    assert result["event.timestamp.stddev"] == pytest.approx(
+        statistics.pstdev(values), rel=1e-9
+    )
+
+
+def test_timer_async_function():
+    import asyncio
+    import inspect
+
+    @timer(key="fetch")
+    async def fetch(delay):
+        await asyncio.sleep(delay)
+        return delay
+
+    assert inspect.iscoroutinefunction(fetch)
+
+    async def handle_request(recorder, delay):
+        with recorder.record():
+            return await fetch(delay)
+
+    async def main():
+        # Created but never awaited: not a call
+        fetch(1).close()
+        return await asyncio.gather(
+            handle_request(slow, 0.05), handle_request(fast, 0.01)
+        )
+
+    slow, fast = Recorder(), Recorder()
+    assert asyncio.run(main()) == [0.05, 0.01]
+
+    slow_result, fast_result = slow.get_result(), fast.get_result()
+    assert slow_result["fetch.count"] == fast_result["fetch.count"] == 1
+    # Each awaited call is attributed to the scope of the task that awaited it
+    assert slow_result["fetch.total_dur"] >= 0.05
+    assert 0.01 <= fast_result["fetch.total_dur"] < 0.05
+
+
+def test_timer_async_running_time():
+    import asyncio
+
+    @timer(key="work", running_time=True)
+    async def work():
+        busy_until = time.perf_counter() + 0.02
+        while time.perf_counter() < busy_until:
+            pass
+        await asyncio.sleep(0.05)
+        raise KeyError("done")
+
+    async def main():
+        with recorder.record():
+            with pytest.raises(KeyError):
+                await work()
+
+    recorder = Recorder()
+    asyncio.run(main())
+
+    result = recorder.get_result()
+    assert result["work.count"] == 1
+    assert result["work.total_dur"] >= 0.07
+    assert 0.02 <= result["work.running_dur"] < 0.05
+
+
+def test_timer_generator_function():
+    import inspect
+
+    @timer(key="stream")
+    def stream(n):
+        time.sleep(0.02)
+        for i in range(n):
+            received = yield i
+            if received:
+                time.sleep(received)
+
+    assert inspect.isgeneratorfunction(stream)
+    recorder = Recorder()
+    with recorder.record():
+        unused = stream(5)  # never iterated: not a call
+        rows = stream(3)
+        assert next(rows) == 0
+        time.sleep(0.05)  # consumer time is not generator time
+        assert rows.send(0.01) == 1
+        assert list(rows) == [2]
+
+        # Abandoned early: still recorded when closed
+        partial = stream(10)
+        next(partial)
+        partial.close()
+    del unused
+
+    result = recorder.get_result()
+    assert result["stream.count"] == 2
+    assert result["stream.items"] == 4
+    assert 0.05 <= result["stream.total_dur"] < 0.08
+    assert 0.04 <= result["stream.first_item_dur"] < 0.06
+
+
+def test_timer_async_generator_function():
+    import asyncio
+    import inspect
+
+    @timer(key="events")
+    async def events(n):
+        for i in range(n):
+            await asyncio.sleep(0.01)
+            yield i
+
+    assert inspect.isasyncgenfunction(events)
+
+    async def main():
+        with recorder.record():
+            items = [item async for item in events(3)]
+            async for item in events(5):
+                await asyncio.sleep(0.02)  # consumer time is not counted
+                break
+        return items
+
+    recorder = Recorder()
+    assert asyncio.run(main()) == [0, 1, 2]
+
+    result = recorder.get_result()
+    assert result["events.count"] == 2
+    assert result["events.items"] == 4
+    assert 0.04 <= result["events.total_dur"] < 0.06
+    assert 0.02 <= result["events.first_item_dur"] < 0.04
+
+
+def test_timer_async_generator_without_collector(monkeypatch):
+    """Outside any recording, async generators are forwarded without timing."""
+    import asyncio
+
+    import scopedstats
+
+    @timer(key="echo")
+    async def echo():
+        received = []
+        try:
+            while True:
+                received.append((yield len(received)))
+        except ValueError:
+            yield received
+
+    def no_timing(*args):
+        raise AssertionError("timed without a collector")
+
+    monkeypatch.setattr(scopedstats, "_StepTimes", no_timing)
+
+    async def main():
+        agen = echo()
+        assert await agen.asend(None) == 0
+        assert await agen.asend("a") == 1
+        assert await agen.athrow(ValueError) == ["a"]
+        await agen.aclose()
+
+    asyncio.run(main())
+
+
+def _spin(seconds):
+    # Burn CPU time rather than wall time, so CPU-clock lower bounds hold
+    # on a busy machine
+    busy_until = time.thread_time() + seconds
+    while time.thread_time() < busy_until:
+        pass
+
+
+def test_timer_clock_modes():
+    def work():
+        _spin(0.02)
+        time.sleep(0.05)
+
+    wall = timer(key="wall")(work)
+    thread_cpu = timer(key="thread_cpu", clock="thread_cpu")(work)
+    process_cpu = timer(key="process_cpu", clock="process_cpu")(work)
+    both = timer(key="both", clock="wall+thread_cpu")(work)
+
+    recorder = Recorder()
+    with recorder.record():
+        for timed_work in (wall, thread_cpu, process_cpu, both):
+            timed_work()
+
+    result = recorder.get_result()
+    assert result["wall.total_dur"] >= 0.07
+    assert 0.01 <= result["thread_cpu.total_dur"] < 0.05
+    assert 0.01 <= result["process_cpu.total_dur"] < 0.05
+    assert result["both.total_dur"] >= 0.07
+    assert 0.01 <= result["both.cpu_dur"] < 0.05
+    assert "wall.cpu_dur" not in result and "thread_cpu.cpu_dur" not in result
+
+    with pytest.raises(ValueError, match="Unknown timer clock"):
+        timer(clock="cpu")
+
+
+def test_timer_clock_modes_for_generators_and_coroutines():
+    import asyncio
+
+    @timer(key="rows", clock="wall+thread_cpu")
+    def rows():
+        for _ in range(2):
+            _spin(0.01)
+            time.sleep(0.02)
+            yield
+
+    @timer(key="task", clock="thread_cpu")
+    async def task():
+        _spin(0.01)
+        await asyncio.sleep(0.05)
+
+    async def main():
+        with recorder.record():
+            # The other task's CPU time is not charged to this one
+            await asyncio.gather(task(), asyncio.to_thread(_spin, 0.03), spin_task())
+
+    async def spin_task():
+        await asyncio.sleep(0.01)
+        _spin(0.03)
+
+    recorder = Recorder()
+    with recorder.record():
+        list(rows())
+    asyncio.run(main())
+
+    result = recorder.get_result()
+    assert result["rows.total_dur"] >= 0.06
+    assert 0.01 <= result["rows.cpu_dur"] < 0.04
+    assert 0.005 <= result["task.total_dur"] < 0.03
+
+
+def test_timer_cpu_clock_async_generator_excludes_suspension():
+    """CPU burned by a sibling task while an async generator awaits is not counted."""
+    import asyncio
+
+    @timer(key="events", clock="wall+thread_cpu")
+    async def events():
+        for i in range(2):
+            _spin(0.005)
+            await asyncio.sleep(0.05)
+            yield i
+
+    async def sibling():
+        await asyncio.sleep(0.01)
+        _spin(0.08)
+
+    async def main():
+        with recorder.record():
+
+            async def consume():
+                return [item async for item in events()]
+
+            items, _ = await asyncio.gather(consume(), sibling())
+        return items
+
+    recorder = Recorder()
+    assert asyncio.run(main()) == [0, 1]
+
+    result = recorder.get_result()
+    assert result["events.total_dur"] >= 0.1
+    assert 0.005 <= result["events.cpu_dur"] < 0.04
+
+
+def test_timed_block():
+    from scopedstats import timed
+
+    parse = timed("parse", tags={"format": "json"})
+    recorder = Recorder()
+    with parse:  # outside any recording: nothing to record into
+        pass
+    with recorder.record():
+        for _ in range(3):
+            with parse:
+                time.sleep(0.01)
+        with pytest.raises(KeyError):
+            with timed("parse", tags={"format": "json"}):
+                raise KeyError("bad input")
+
+    result = recorder.get_result()
+    assert result["parse.count"] == 4
+    assert result["parse.total_dur"] >= 0.03
+    assert recorder.get_result(tag_filter={"format": "json"})["parse.count"] == 4
+
+
+def test_timer_start_stop():
+    from scopedstats import Timer, timer_start, timer_stop
+
+    handle = Timer("section", tags={"step": "load"})
+    recorder = Recorder()
+    with recorder.record():
+        start = timer_start()
+        time.sleep(0.01)
+        duration = timer_stop(handle, start)
+
+    assert duration >= 0.01
+    result = recorder.get_result()
+    assert result["section.count"] == 1
+    assert result["section.total_dur"] == duration
+
+
+def test_timer_self_time_and_call_tree():
+    @timer(key="query", self_time=True)
+    def query():
+        time.sleep(0.01)
+
+    @timer(key="render", self_time=True)
+    def render():
+        time.sleep(0.02)
+
+    @timer(key="handler", self_time=True)
+    def handler():
+        time.sleep(0.01)
+        query()
+        query()
+        with inner.record():
+            render()
+
+    outer, inner = Recorder(), Recorder()
+    with outer.record():
+        handler()
+        query()  # top-level call: no edge
+
+    result = outer.get_result()
+    assert result["handler.total_dur"] >= 0.05
+    assert 0.01 <= result["handler.self_dur"] < 0.02
+    assert result["handler.self_dur"] == pytest.approx(
+        result["handler.total_dur"]
+        - result["handler -> query.total_dur"]
+        - result["handler -> render.total_dur"]
+    )
+    assert result["query.count"] == 3
+    assert result["handler -> query.count"] == 2
+    assert result["handler -> render.count"] == 1
+    assert "handler -> handler.count" not in result
+
+    # The nested scope sees the edge from its parent timer
+    inner_result = inner.get_result()
+    assert inner_result["handler -> render.count"] == 1
+    assert inner_result["render.self_dur"] == inner_result["render.total_dur"]
+
+
+def test_timer_self_time_coroutines_and_validation():
+    import asyncio
+
+    @timer(key="fetch", self_time=True)
+    async def fetch():
+        await asyncio.sleep(0.02)
+
+    @timer(key="view", self_time=True)
+    async def view():
+        await fetch()
+        await asyncio.sleep(0.01)
+
+    async def main():
+        with recorder.record():
+            await view()
+
+    recorder = Recorder()
+    asyncio.run(main())
+    result = recorder.get_result()
+    assert result["view -> fetch.count"] == 1
+    assert 0.01 <= result["view.self_dur"] < 0.02
+
+    with pytest.raises(ValueError, match="wall clock"):
+        timer(self_time=True, clock="thread_cpu")
+
+    def gen():
+        yield
+
+    with pytest.raises(ValueError, match="generator"):
+        timer(gen, self_time=True)
+
+
+def test_timer_outermost_only_recursion():
+    import contextvars
+    import threading
+
+    @timer(key="walk", outermost_only=True)
+    def walk(depth):
+        time.sleep(0.005)
+        if depth:
+            walk(depth - 1)
+
+    @timer(key="walk_all")
+    def walk_all(depth):
+        time.sleep(0.005)
+        if depth:
+            walk_all(depth - 1)
+
+    recorder = Recorder()
+    with recorder.record():
+        start = time.perf_counter()
+        walk(5)
+        wall = time.perf_counter() - start
+        start = time.perf_counter()
+        walk_all(5)
+        wall_all = time.perf_counter() - start
+
+        # Each thread has its own outermost call
+        threads = [
+            threading.Thread(target=contextvars.copy_context().run, args=(walk, 2))
+            for _ in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    result = recorder.get_result()
+    assert result["walk.count"] == 6 + 2 * 3
+    assert result["walk_all.count"] == 6
+    # Nested activations are counted again: each sleep once per enclosing call
+    assert result["walk_all.total_dur"] > 1.5 * wall_all
+    assert 2 * 0.015 + 0.03 <= result["walk.total_dur"] < 2 * wall + 0.03
+
+
+def test_timer_outermost_only_per_collector():
+    import asyncio
+
+    inner = Recorder()
+
+    @timer(key="visit", outermost_only=True)
+    def visit(depth):
+        if depth == 2:
+            with inner.record():
+                return visit(depth - 1)
+        time.sleep(0.02)
+        if depth:
+            visit(depth - 1)
+
+    @timer(key="resolve", outermost_only=True)
+    async def resolve(depth):
+        await asyncio.sleep(0.02)
+        if depth:
+            await resolve(depth - 1)
+
+    async def main():
+        with outer.record():
+            await resolve(2)
+
+    outer = Recorder()
+    with outer.record():
+        visit(3)
+    asyncio.run(main())
+
+    # The call that entered the inner scope is outermost there
+    inner_result = inner.get_result()
+    assert inner_result["visit.count"] == 2
+    assert 0.04 <= inner_result["visit.total_dur"] < 0.06
+    result = outer.get_result()
+    assert result["visit.count"] == 4
+    assert result["visit.total_dur"] < 0.1 + inner_result["visit.total_dur"]
+    assert result["resolve.count"] == 3
+    assert 0.06 <= result["resolve.total_dur"] < 0.1
+
+
+def test_trace_spans():
+    import threading
+
+    from scopedstats import timed
+
+    @timer(key="load", tags={"table": "users"})
+    def load():
+        time.sleep(0.01)
+
+    recorder, inner = Recorder(), Recorder()
+    with recorder.record(trace=True):
+        with timed("request"):
+            load()
+            with inner.record():  # untraced: spans go to the enclosing trace
+                load()
+    with recorder.record():
+        load()  # untraced recording: no spans
+    assert inner.get_spans() == []
+
+    spans = recorder.get_spans()
+    assert [span.key for span in spans] == ["request", "load", "load"]
+    request, first_load, second_load = spans
+    assert first_load.tags == {"table": "users"}
+    assert request.start_ns <= first_load.start_ns < first_load.end_ns
+    assert first_load.end_ns <= second_load.start_ns < second_load.end_ns
+    assert second_load.end_ns <= request.end_ns
+    assert first_load.end_ns - first_load.start_ns >= 10_000_000
+    assert {span.thread_id for span in spans} == {threading.get_ident()}
+    assert {span.task_id for span in spans} == {None}
+
+
+def test_trace_spans_bounded_and_chrome_export(tmp_path):
+    import asyncio
+    import json
+
+    from scopedstats import Timer
+
+    handle = Timer("step")
+
+    @timer(key="fetch")
+    async def fetch(i):
+        await asyncio.sleep(0.01 * i)
+
+    async def main():
+        with recorder.record(trace=True, max_spans=5):
+            await asyncio.gather(fetch(1), fetch(2))
+            for _ in range(10):
+                handle.record(0.001)
+
+    recorder = Recorder()
+    asyncio.run(main())
+
+    spans = recorder.get_spans()
+    assert len(spans) == 5
+    assert len({span.task_id for span in spans if span.key == "fetch"}) == 2
+    # Counters are unaffected by the span limit
+    assert recorder.get_result()["step.count"] == 10
+
+    path = tmp_path / "trace.json"
+    trace = recorder.export_chrome_trace(str(path))
+    assert json.loads(path.read_text()) == trace
+    assert trace["otherData"] == {"dropped_spans": 7}
+    complete = [event for event in trace["traceEvents"] if event["ph"] == "X"]
+    assert [event["name"] for event in complete] == ["fetch", "fetch"] + ["step"] * 3
+    assert complete[0]["ts"] == 0
+    assert max(event["dur"] for event in complete) >= 20_000
+    tracks = [event for event in trace["traceEvents"] if event["ph"] == "M"]
+    assert len(tracks) == 3
+
+
+def test_record_sampling():
+    """Unsampled scopes record nothing; nested scopes follow the outer decision."""
+    from scopedstats import _current_collector
+
+    outer, inner = Recorder(), Recorder()
+    with outer.record(sample_rate=0):
+        assert _current_collector.get() is None
+        incr("requests")
+        with inner.record():
+            incr("requests")
+    assert outer.get_result() == {}
+    assert inner.get_result() == {}
+
+    with outer.record(sample_rate=1):
+        incr("requests")
+        with inner.record(sample_rate=0):
+            incr("db.queries")
+    result = outer.get_result()
+    assert result["requests"] == 1
+    assert result["db.queries"] == 1
+    assert result["sample_rate"] == 1
+    assert inner.get_result()["sample_rate"] == 1
+
+    # Inside a plain recording, an unsampled scope leaves its collector in place
+    with outer.record():
+        with inner.record(sample_rate=0):
+            incr("requests")
+    assert outer.get_result()["requests"] == 2
+
+    with pytest.raises(ValueError, match="sample_rate"):
+        outer.record(sample_rate=1.5)
+    with pytest.raises(ValueError, match="sample_key"):
+        outer.record(sample_key="abc")
+
+
+def test_record_sampling_by_key():
+    """Keyed sampling is deterministic and close to the requested rate."""
+    decisions = {}
+    for attempt in range(2):
+        for request_id in range(2000):
+            recorder = Recorder()
+            with recorder.record(sample_rate=0.25, sample_key=f"req-{request_id}"):
+                incr("requests")
+            sampled = recorder.get_result().get("requests", 0) == 1
+            assert decisions.setdefault(request_id, sampled) == sampled
+
+    fraction = sum(decisions.values()) / len(decisions)
+    assert 0.2 < fraction < 0.3
+
+    recorder = Recorder()
+    with recorder.record(sample_rate=0.25, sample_key="req-0"):
+        incr("requests")
+    if decisions[0]:
+        assert recorder.get_result()["sample_rate"] == 0.25
+
+
+def test_record_sample_rate_stays_with_its_recorder():
+    """A sampled scope reports its rate only to its own recorder."""
+    outer, inner = Recorder(), Recorder()
+    with outer.record():
+        incr("requests")
+        # "req-0" is sampled at a rate of 0.5
+        with inner.record(sample_rate=0.5, sample_key="req-0"):
+            incr("db.queries")
+
+    result = outer.get_result()
+    assert result["db.queries"] == 1
+    assert "sample_rate" not in result
+    assert inner.get_result()["sample_rate"] == 0.5
+    assert inner.get_result()["db.queries"] == 1
+
+def test_record_min_duration():
+    """Fast scopes are discarded but still count towards enclosing scopes."""
+    outer, slow = Recorder(), Recorder()
+    with outer.record():
+        for sleep in (0, 0.02, 0):
+            with slow.record(min_duration=0.01):
+                incr("requests")
+                time.sleep(sleep)
+
+    assert slow.get_result()["requests"] == 1
+    assert slow.get_result()["total_recording_duration"] >= 0.02
+    assert outer.get_result()["requests"] == 3
+
+    recorder = Recorder()
+    with recorder.record(min_duration=10):
+        incr("requests")
+    assert recorder.get_result() == {}
+    with pytest.raises(ValueError, match="No recording has occurred"):
+        recorder.get_result(require_recording=True)
+
+
+def test_record_keep_if():
+    """keep_if sees the scope's duration and data, nested scopes included."""
+    from scopedstats import gauge, timed
+
+    seen = []
+
+    def keep_if(duration, collector):
+        depth = collector.get("depth", default=None)
+        seen.append((duration, collector.get("errors"), depth))
+        return collector.get("errors", tags={"kind": "db"}) > 0
+
+    recorder = Recorder()
+    for fail in (False, True):
+        with recorder.record(trace=True, keep_if=keep_if):
+            gauge("depth", 1)
+            with Recorder().record():
+                gauge("depth", 2)
+                incr("errors", tags={"kind": "db"}, amount=int(fail))
+            incr("errors", amount=3)
+            with timed("step"):
+                pass
+
+    assert [errors for _, errors, _ in seen] == [3, 3]
+    assert [depth for _, _, depth in seen] == [2, 2]
+    assert all(duration > 0 for duration, _, _ in seen)
+    result = recorder.get_result()
+    assert result["errors"] == 4
+    assert result["step.count"] == 1
+    assert len(recorder.get_spans()) == 1
+
+
+def test_record_keep_if_error_keeps_scope():
+    """A keep_if that raises propagates, and the scope is still kept."""
+    from scopedstats import timed
+
+    def keep_if(duration, collector):
+        raise RuntimeError("broken predicate")
+
+    outer = Recorder()
+    inner = Recorder()
+    with outer.record():
+        with pytest.raises(RuntimeError, match="broken predicate"):
+            with inner.record(trace=True, keep_if=keep_if):
+                incr("x")
+                with timed("block"):
+                    pass
+        incr("y")
+
+    result = outer.get_result()
+    assert (result["x"], result["y"], result["block.count"]) == (1, 1, 1)
+    assert inner.get_result()["x"] == 1
+    assert len(inner.get_spans()) == 1
+
+@pytest.mark.parametrize("storage", ["nested", "flat", "array"])
+def test_collector_storage_is_reused(storage):
+    """Released storage is reused by later scopes without leaking values."""
+    from scopedstats import _STORAGE_ENGINES, counter
+
+    engine = _STORAGE_ENGINES[storage]
+    engine._pool.clear()
+    rows = counter("rows")
+    recorder = Recorder(storage=storage)
+
+    seen = set()
+    for _ in range(5):
+        with recorder.record():
+            incr("requests")
+            rows.incr(2)
+        recorder.get_result()
+        seen.add(len(engine._pool))
+    # Each root scope's storage went back to the pool and was taken again
+    assert seen == {1}
+    assert recorder.get_result()["requests"] == 5
+    assert recorder.get_result()["rows"] == 10
+
+    discarded = Recorder(storage=storage)
+    with discarded.record(min_duration=10):
+        incr("requests")
+    assert len(engine._pool) == 1
+    with recorder.record():
+        pass
+    assert recorder.get_result()["requests"] == 5
+
+
+
+@pytest.mark.parametrize("storage", ["nested", "flat", "array"])
+def test_nested_collector_storage_is_reused(storage):
+    """Nested scopes, kept or discarded, return their storage to the pool."""
+    from scopedstats import _STORAGE_ENGINES, _current_collector
+
+    engine = _STORAGE_ENGINES[storage]
+    depth = 4
+    recorders = [Recorder(storage=storage) for _ in range(depth)]
+    storages = set()
+
+    def nested(level):
+        keep_if = (lambda duration, collector: False) if level % 2 else None
+        with recorders[level].record(keep_if=keep_if):
+            incr("requests", tags={"level": str(level)})
+            collector = _current_collector.get()
+            data = collector._values if storage == "array" else collector._data
+            storages.add(id(data))
+            if level + 1 < depth:
+                nested(level + 1)
+
+    def request():
+        nested(0)
+        for recorder in recorders:
+            recorder.get_result()
+
+    # The first request also allocates each recorder's own storage
+    engine._pool.clear()
+    request()
+    storages.clear()
+    for _ in range(20):
+        request()
+        assert len(engine._pool) == depth
+
+    # Every request takes the same storage from the pool again
+    assert len(storages) == depth
+    # Discarded scopes still count towards the recorders enclosing them
+    for level, recorder in enumerate(recorders):
+        expected = 0 if level % 2 else 21 * (depth - level)
+        assert recorder.get_result().get("requests", 0) == expected
+
+def test_collector_pool_keeps_key_dicts_and_is_bounded():
+    """Nested storage keeps per-key dicts; the pool size is configurable."""
+    from scopedstats import (
+        _DEFAULT_COLLECTOR_POOL_SIZE,
+        _StatsCollector,
+        _current_collector,
+        set_collector_pool_size,
+    )
+
+    try:
+        set_collector_pool_size(2)
+        recorder = Recorder()
+        with recorder.record():
+            incr("requests", tags={"path": "/a"})
+        recorder.get_result()
+        (data,) = _StatsCollector._pool
+        tags_data = data.spare["requests"]
+
+        with recorder.record():
+            incr("requests", tags={"path": "/b"})
+            assert _current_collector.get()._data["requests"] is tags_data
+        assert recorder.get_result(group_by="path")["requests"] == {
+            ("/a",): 1,
+            ("/b",): 1,
+        }
+
+        collectors = [_StatsCollector() for _ in range(4)]
+        for collector in collectors:
+            collector.increment("requests")
+        for collector in collectors:
+            collector._release()
+        assert len(_StatsCollector._pool) == 2
+
+        set_collector_pool_size(0)
+        with recorder.record():
+            incr("requests")
+        recorder.get_result()
+        assert len(_StatsCollector._pool) == 0
+        with pytest.raises(ValueError, match="maxsize"):
+            set_collector_pool_size(-1)
+    finally:
+        set_collector_pool_size(_DEFAULT_COLLECTOR_POOL_SIZE)
+
+
+def test_disable_and_enable():
+    """While disabled nothing is recorded, even inside an active scope."""
+    import asyncio
+
+    from scopedstats import (
+        _current_collector,
+        counter,
+        disable,
+        enable,
+        gauge,
+        is_enabled,
+        timed,
+    )
+
+    @timer(key="work")
+    def work():
+        return "done"
+
+    @timer(key="async_work")
+    async def async_work():
+        return "done"
+
+    rows = counter("rows")
+    recorder = Recorder()
+    try:
+        with recorder.record():
+            outer = _current_collector.get()
+            disable()
+            assert not is_enabled()
+            incr("requests")
+            gauge("depth", 1)
+            rows.incr()
+            assert work() == "done"
+            assert asyncio.run(async_work()) == "done"
+            with timed("block"):
+                pass
+            with Recorder().record():
+                assert _current_collector.get() is outer
+            enable()
+            incr("requests", amount=2)
+    finally:
+        enable()
+
+    assert is_enabled()
+    result = recorder.get_result()
+    assert result["requests"] == 2
+    assert set(result) == {"requests", "total_recording_duration"}
+
+
+def test_disabled_record_scope():
+    """A scope entered while disabled stays inert; timers are reversible."""
+    from scopedstats import disable, enable
+
+    def work():
+        return "done"
+
+    recorder = Recorder()
+    disable()
+    try:
+        timed_work = timer(key="work")(work)
+        with recorder.record():
+            enable()
+            incr("requests")
+            timed_work()
+    finally:
+        enable()
+    assert recorder.get_result() == {}
+
+    # Decorated while disabled, timed again once enabled
+    with recorder.record():
+        incr("requests")
+        assert timed_work() == "done"
+    result = recorder.get_result()
+    assert result["requests"] == 1
+    assert result["work.count"] == 1
+
+
+@pytest.mark.parametrize("storage", ["nested", "flat", "array"])
+def test_incr_many_matches_incr(storage):
+    """incr_many gives the same result as one incr() per update."""
+    from scopedstats import incr_many
+
+    updates = [("db.queries", 3), ("cache.hits", 1), ("db.queries", 2.5)]
+    tags = {"endpoint": "/users"}
+
+    expected, batched = Recorder(storage=storage), Recorder(storage=storage)
+    with expected.record():
+        for key, amount in updates:
+            incr(key, tags=tags, amount=amount)
+        incr("errors", amount=2)
+    with batched.record():
+        incr_many(updates, tags=tags)
+        incr_many({"errors": 2})
+
+    def counts(recorder):
+        result = recorder.get_result(group_by="endpoint")
+        del result["total_recording_duration"]
+        return result
+
+    assert counts(batched) == counts(expected)
+    assert counts(batched)["db.queries"] == {("/users",): 5.5}
+
+
+def test_incr_many_outside_scope_and_disabled():
+    """incr_many is a no-op without a collector or while disabled."""
+    from scopedstats import disable, enable, incr_many
+
+    incr_many({"requests": 1})
+    recorder = Recorder()
+    with recorder.record():
+        disable()
+        try:
+            incr_many({"requests": 1})
+        finally:
+            enable()
+        incr_many(iter([("requests", 2)]))
+    assert recorder.get_result()["requests"] == 2
+
+
+def test_released_storage_ignores_late_writes():
+    """Late writes into a released scope never reach the scope reusing it."""
+    import asyncio
+
+    from scopedstats import _FlatStatsCollector, _StatsCollector, counter
+
+    _StatsCollector._pool.clear()
+    _FlatStatsCollector._pool.clear()
+
+    @timer(key="g")
+    def gen():
+        yield 1
+
+    r1, r2 = Recorder(storage="flat"), Recorder(storage="flat")
+    with r1.record():
+        assert list(gen()) == [1]
+        steps = gen()
+        next(steps)
+    assert r1.get_result()["g.count"] == 1
+    with r2.record():
+        incr("requests")
+        steps.close()
+    assert set(r2.get_result()) == {"requests", "total_recording_duration"}
+
+    hits = counter("hits")
+
+    async def late():
+        hits.incr(100)
+
+    async def main():
+        r3, r4 = Recorder(), Recorder()
+        with r3.record():
+            hits.incr()
+            task = asyncio.get_running_loop().create_task(late())
+        r3.get_result()
+        with r4.record():
+            await task
+            hits.incr()
+        return r3.get_result()["hits"], r4.get_result()["hits"]
+
+    assert asyncio.run(main()) == (1, 1)
+
+
+def test_many_nested_scopes_are_merged_into_parent():
+    """A long-lived scope holds its series, not its nested scopes."""
+    from scopedstats import _current_collector, gauge, observe
+
+    scopes = 643
+    outer, inner = Recorder(), Recorder()
+    with outer.record():
+        collector = _current_collector.get()
+        for i in range(scopes):
+            with inner.record():
+                incr("requests", tags={"shard": str(i % 2)})
+                gauge("last", i)
+                observe("size", i)
+                with Recorder().record():
+                    incr("db.queries", amount=2)
+            assert len(list(collector._items())) == min(i + 1, 2) + 3
+        gauge("last", -1)
+
+    for recorder, last in ((outer, -1), (inner, scopes - 1)):
+        result = recorder.get_result()
+        assert result["requests"] == scopes
+        assert result["db.queries"] == 2 * scopes
+        assert result["last"] == last
+        assert recorder.get_quantile("size", 1) == pytest.approx(scopes - 1, rel=0.02)
+
+
+def test_trace_spans_nested_traced_scopes():
+    """A span is reported once per recorder, however traced scopes nest."""
+    from scopedstats import timed
+
+    outer, other = Recorder(), Recorder()
+    with outer.record(trace=True):
+        with outer.record(trace=True):
+            with timed("inner"):
+                pass
+        with other.record(trace=True):
+            with timed("other"):
+                pass
+        with outer.record(trace=True, min_duration=10):
+            with timed("discarded"):
+                pass
+
+    assert [span.key for span in outer.get_spans()] == ["inner", "other", "discarded"]
+    assert [span.key for span in other.get_spans()] == ["other"]
+    events = outer.export_chrome_trace()["traceEvents"]
+    assert len([event for event in events if event["ph"] == "X"]) == 3
+
+
+def test_trace_span_start_is_wall_start():
+    """Spans of CPU-clock and generator timers cover their wall-clock extent."""
+
+    @timer(key="waits", clock="thread_cpu")
+    def waits():
+        time.sleep(0.03)
+
+    @timer(key="rows")
+    def rows():
+        yield 1
+        yield 2
+
+    recorder = Recorder()
+    with recorder.record(trace=True):
+        before = time.perf_counter_ns()
+        waits()
+        for _ in rows():
+            time.sleep(0.03)  # consumer time: outside the frame, inside the span
+        after = time.perf_counter_ns()
+
+    spans = {span.key: span for span in recorder.get_spans()}
+    assert recorder.get_result()["waits.total_dur"] < 0.02
+    for span in spans.values():
+        assert before <= span.start_ns <= span.end_ns <= after
+        assert span.end_ns - span.start_ns >= 30_000_000
+    assert spans["waits"].end_ns <= spans["rows"].start_ns
+
+
+def test_array_collector_get_does_not_register_series():
+    """Reading a missing series from the array engine leaves the registry alone."""
+    from scopedstats import _current_collector, _series_registry
+
+    recorder = Recorder(storage="array")
+    with recorder.record():
+        incr("requests")
+        collector = _current_collector.get()
+        size = len(_series_registry)
+        assert collector.get("never.recorded", tags={"id": "42"}) == 0
+        assert collector.get("requests") == 1
+        assert len(_series_registry) == size
+
+
 if __name__ == "__main__":
     pytest.main([__file__])